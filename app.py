@@ -2,6 +2,7 @@ from flask import Flask, render_template, redirect, url_for, request, jsonify
 from logic import home, diskusi, ai  # Updated import
 from datetime import timedelta, datetime
 import os
+import threading
 
 app = Flask(__name__)
 
@@ -17,6 +18,13 @@ app.config['UPLOAD_FOLDER'] = 'static/uploads'
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# Load NLTK and the AI model in the background so the server starts
+# accepting requests right away; set RECIPE_AI_WARMUP=0 to load on first use.
+# Training worker processes re-import this module as __mp_main__ and must
+# not warm up.
+if os.environ.get('RECIPE_AI_WARMUP', '1') == '1' and __name__ != '__mp_main__':
+    threading.Thread(target=ai.warm_up, daemon=True).start()
+
 # Middleware to make current_user available in all templates
 @app.context_processor
 def inject_user():
@@ -53,6 +61,26 @@ def api_diskusi_messages():
 def ai_page():
     return ai.handle_ai_request()
 
+@app.route('/api/ai/batch', methods=['POST'])
+def api_ai_batch():
+    return ai.handle_ai_batch_request()
+
+@app.route('/api/ai/recipes', methods=['POST'])
+def api_ai_add_recipes():
+    return ai.api_add_recipes()
+
+@app.route('/api/ai/stats')
+def api_ai_stats():
+    return ai.api_get_ai_stats()
+
+@app.route('/api/ai/ingredients/suggest')
+def api_ai_suggest_ingredients():
+    return ai.api_suggest_ingredients()
+
+@app.route('/api/ai/recipes/<int:recipe_index>/similar')
+def api_ai_similar_recipes(recipe_index):
+    return ai.api_get_similar_recipes(recipe_index)
+
 # Traditional Authentication routes
 @app.route('/login-page')
 def login_page():
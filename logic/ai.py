@@ -1,16 +1,24 @@
 import json
-import numpy as np
-import pandas as pd
-from flask import render_template, request, jsonify
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import stopwords
+from flask import render_template, request, jsonify, Response
 import string
-import joblib
+import base64
+import functools
+import hashlib
+import hmac
+import bisect
+import collections
+import concurrent.futures
+import heapq
+import itertools
 import os
 import re
+import threading
+import time
+
+# numpy, scikit-learn, scipy, NLTK and joblib are imported inside the
+# functions that use them, so importing this module (and starting the app)
+# stays fast. They are loaded on the first model load or preprocess call, or
+# ahead of time by warm_up().
 
 # Import user context from home.py
 try:
@@ -20,230 +28,1759 @@ except ImportError:
     def get_current_user():
         return None
 
-# Download NLTK resources if not already downloaded
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/stopwords')
-    nltk.data.find('corpora/wordnet')
-except LookupError:
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    nltk.download('wordnet')
-
-# Initialize lemmatizer
-lemmatizer = WordNetLemmatizer()
-stop_words = set(stopwords.words('english'))
+# NLTK lemmatizer and stopword set, created on first use by get_nlp_resources()
+_nlp_lock = threading.Lock()
+_nlp_resources = {}
+
+def get_nlp_resources():
+    """Return (lemmatizer, stop_words), setting up NLTK on first use"""
+    if 'lemmatizer' not in _nlp_resources:
+        with _nlp_lock:
+            if 'lemmatizer' not in _nlp_resources:
+                import nltk
+                from nltk.stem import WordNetLemmatizer
+                from nltk.corpus import stopwords
+                
+                # Download NLTK resources if not already downloaded
+                try:
+                    nltk.data.find('tokenizers/punkt')
+                    nltk.data.find('corpora/stopwords')
+                    nltk.data.find('corpora/wordnet')
+                except LookupError:
+                    nltk.download('punkt')
+                    nltk.download('stopwords')
+                    nltk.download('wordnet')
+                
+                lemmatizer = WordNetLemmatizer()
+                # WordNet itself is read lazily on the first lemmatize call
+                lemmatizer.lemmatize('warm')
+                _nlp_resources['stop_words'] = set(stopwords.words('english'))
+                _nlp_resources['lemmatizer'] = lemmatizer
+    return _nlp_resources['lemmatizer'], _nlp_resources['stop_words']
 
 # Path to the model and data files
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+
+# Pickled model written by older versions; converted into MODEL_DIR once
+# when that has no saved model yet
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model.joblib')
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'model.json')
 
+# Large catalogs can be shipped as JSON Lines (one recipe object per line);
+# when this file exists it is streamed instead of model.json
+DATA_JSONL_PATH = os.path.join(os.path.dirname(__file__), 'model.jsonl')
+
+# Number of recipes preprocessed and vectorized at a time during training
+TRAIN_CHUNK_SIZE = int(os.environ.get('RECIPE_TRAIN_CHUNK_SIZE', '10000'))
+
+# Worker processes that preprocess training chunks in `python ai.py train`;
+# 0 uses every CPU and 1 trains in-process
+TRAIN_WORKERS = int(os.environ.get('RECIPE_TRAIN_WORKERS', '0')) or os.cpu_count() or 1
+
+# Worker processes for retrains inside the web server (a missing or stale
+# model, or the refit after added recipes), kept low so requests being
+# served on the same host keep their CPUs
+SERVER_TRAIN_WORKERS = max(1, min(int(os.environ.get('RECIPE_SERVER_TRAIN_WORKERS', '2')), TRAIN_WORKERS))
+
+# TF-IDF parameters shared by full training and incremental updates
+TFIDF_PARAMS = {
+    'min_df': 1,
+    'max_df': 0.95,
+    'max_features': None,
+    'ngram_range': (1, 2),
+    'use_idf': True,
+    'smooth_idf': True,
+    'sublinear_tf': True
+}
+
+# Recipes added incrementally trigger a full refit once they exceed this
+# share of the recipes seen by the last fit, or once the last fit is older
+# than REFIT_INTERVAL seconds
+REFIT_DRIFT_THRESHOLD = float(os.environ.get('RECIPE_REFIT_DRIFT_THRESHOLD', '0.2'))
+REFIT_INTERVAL = float(os.environ.get('RECIPE_REFIT_INTERVAL', '86400'))
+
+# Usernames of traditional accounts allowed to add recipes, comma separated.
+# Web3 accounts cannot be editors: wallet logins are not signature-checked.
+EDITOR_USERNAMES = frozenset(
+    name.strip() for name in os.environ.get('RECIPE_EDITORS', '').split(',') if name.strip()
+)
+
+# Shared secret that also allows adding recipes, sent in the X-Editor-Token
+# header (for scripts); unset means only editor accounts can
+EDITOR_TOKEN = os.environ.get('RECIPE_EDITOR_TOKEN', '')
+
+# Minimum cosine similarity for a recipe to be recommended
+SIMILARITY_THRESHOLD = 0.05
+
+# 'tfidf' ranks by text similarity, 'coverage' by the share of a recipe's
+# ingredients the user already has
+RANKING_MODES = ('tfidf', 'coverage')
+
+# Limits for the batch recommendation API
+MAX_BATCH_QUERIES = int(os.environ.get('RECIPE_MAX_BATCH_QUERIES', '1000'))
+MAX_RECOMMENDATIONS = 50
+
+# Streaming (NDJSON) mode of /ai: the most results one query can page
+# through, and the default number of results per page
+MAX_STREAM_RECOMMENDATIONS = int(os.environ.get('RECIPE_MAX_STREAM_RECOMMENDATIONS', '200'))
+STREAM_PAGE_SIZE = int(os.environ.get('RECIPE_STREAM_PAGE_SIZE', '50'))
+
+# Ingredient autocomplete: default and maximum number of suggestions, and
+# how many popular ingredients the AI page shows before the user types
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+POPULAR_INGREDIENTS_SHOWN = 8
+
+# Largest edit distance corrected when a query word is not an ingredient
+# word; shorter words get less (see _allowed_edit_distance). 0 disables it
+TYPO_MAX_EDIT_DISTANCE = int(os.environ.get('RECIPE_TYPO_MAX_EDIT_DISTANCE', '2'))
+
+# Similar-recipes table: neighbors kept per recipe, and the memory budget
+# for one block of the similarity product while computing it
+NEIGHBOR_COUNT = int(os.environ.get('RECIPE_NEIGHBOR_COUNT', '20'))
+NEIGHBOR_BLOCK_BYTES = int(os.environ.get('RECIPE_NEIGHBOR_BLOCK_MB', '64')) * 2 ** 20
+
+# Size and lifetime of the recommendation result cache
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECIPE_CACHE_SIZE', '1024'))
+RECOMMENDATION_CACHE_TTL = float(os.environ.get('RECIPE_CACHE_TTL', '300'))
+
+# Scoring for /ai runs on a bounded thread pool so a burst of queries can't
+# tie up every request thread. Requests beyond SCORING_QUEUE_LIMIT pending
+# scorings are rejected, and waiters give up after SCORING_TIMEOUT seconds.
+SCORING_WORKERS = int(os.environ.get('RECIPE_SCORING_WORKERS', '0')) or min(4, os.cpu_count() or 1)
+SCORING_QUEUE_LIMIT = int(os.environ.get('RECIPE_SCORING_QUEUE_LIMIT', '64'))
+SCORING_TIMEOUT = float(os.environ.get('RECIPE_SCORING_TIMEOUT', '10'))
+
+# How often (in seconds) request threads check the model files for changes
+MODEL_CHECK_INTERVAL = float(os.environ.get('RECIPE_MODEL_CHECK_INTERVAL', '2'))
+
+# Most queries replayed against a newly loaded model before it is published
+WARMUP_QUERIES = int(os.environ.get('RECIPE_WARMUP_QUERIES', '64'))
+
+# Number of popular ingredients the warm-up builds sample queries from
+WARMUP_POPULAR_INGREDIENTS = 8
+
+# Process-wide model holder shared by all request threads. The model itself is
+# never mutated; a reload builds a new one and swaps the reference atomically,
+# so requests that already hold the old model finish with it undisturbed.
+_model_lock = threading.Lock()
+_model_update_lock = threading.Lock()
+_model_state = {
+    'model': None,
+    'signature': None,
+    'checked_at': 0.0,
+    'reloading': False,
+    'version': 0
+}
+
+# Source of in-process model versions, taken when a model is warmed up so its
+# cache entries can be written before it is published
+_model_versions = itertools.count(1)
+
+# Ranked results keyed on (model version, canonical query, result count).
+# Entries hold (expires_at, (indices, scores)) so formatting stays per request.
+_recommendation_cache = collections.OrderedDict()
+_recommendation_cache_lock = threading.Lock()
+_recommendation_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+# Scorings in flight keyed like the result cache, so identical concurrent
+# queries wait on one computation instead of each running their own
+_scoring_lock = threading.Lock()
+_scoring_pool = None
+_scoring_in_flight = {}
+_scoring_stats = {'submitted': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0}
+
+class ScoringQueueFull(Exception):
+    """Raised when SCORING_QUEUE_LIMIT scorings are already pending"""
+
+# Maximum number of distinct tokens whose lemma is kept in memory
+LEMMA_CACHE_SIZE = int(os.environ.get('RECIPE_LEMMA_CACHE_SIZE', '100000'))
+
+# Translation table that deletes every punctuation character in one pass
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+@functools.lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _lemmatize(token):
+    """Lemmatize a single token, memoized across calls"""
+    return get_nlp_resources()[0].lemmatize(token)
+
 def preprocess_text(text):
     """Preprocess text for NLP tasks"""
-    # Convert to lowercase
-    text = text.lower()
-    
-    # Remove punctuation
-    text = ''.join([char for char in text if char not in string.punctuation])
+    # Convert to lowercase and remove punctuation
+    text = text.lower().translate(_PUNCTUATION_TABLE)
     
     # Simple tokenize by splitting on whitespace instead of using nltk.word_tokenize
     # This avoids the punkt_tab issue
     tokens = text.split()
     
     # Remove stopwords and lemmatize
-    tokens = [lemmatizer.lemmatize(token) for token in tokens if token not in stop_words]
+    stop_words = get_nlp_resources()[1]
+    tokens = [_lemmatize(token) for token in tokens if token not in stop_words]
     
     return ' '.join(tokens)
 
-def train_model():
-    """Train the NLM recommendation model using the data from model.json"""
+def preprocess_texts(texts):
+    """Preprocess many strings at once, normalizing each distinct string once"""
+    normalized = {}
+    results = []
+    for text in texts:
+        if text not in normalized:
+            normalized[text] = preprocess_text(text)
+        results.append(normalized[text])
+    return results
+
+def build_recipe_contexts(names, ingredient_lists):
+    """Preprocess recipes into the text each one is indexed by"""
+    ingredient_lists = list(ingredient_lists)
+    
+    # Preprocess ingredients in one batch and combine into a single string for each recipe
+    all_ingredients = [ingredient for ingredients in ingredient_lists for ingredient in ingredients]
+    ingredient_terms = dict(zip(all_ingredients, preprocess_texts(all_ingredients)))
+    ingredients_texts = [
+        ' '.join([ingredient_terms[ingredient] for ingredient in ingredients])
+        for ingredients in ingredient_lists
+    ]
+    
+    # Create recipe descriptions that combine name and ingredients for better context
+    return [
+        f"{name} {ingredients_text}"
+        for name, ingredients_text in zip(preprocess_texts(names), ingredients_texts)
+    ]
+
+def get_data_path():
+    """The recipe catalog to train from: model.jsonl when present, else model.json"""
+    return DATA_JSONL_PATH if os.path.exists(DATA_JSONL_PATH) else DATA_PATH
+
+def iter_recipe_chunks(path, chunk_size=TRAIN_CHUNK_SIZE):
+    """Yield lists of up to chunk_size recipes, streaming JSON Lines catalogs line by line"""
+    if path.endswith('.jsonl'):
+        chunk = []
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                chunk.append(json.loads(line))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+        return
+    
+    with open(path, 'r', encoding='utf-8') as file:
+        recipes = json.load(file)['recipes']
+    for start in range(0, len(recipes), chunk_size):
+        yield recipes[start:start + chunk_size]
+
+def make_vectorizer(vocabulary, idf, stop_words=None):
+    """Build a ready-to-use TfidfVectorizer from a vocabulary, IDF weights and the pruned stop_words"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    
+    vectorizer = TfidfVectorizer(vocabulary=vocabulary, **TFIDF_PARAMS)
+    vectorizer.idf_ = idf
+    vectorizer.stop_words_ = set(stop_words or ())
+    return vectorizer
+
+def count_terms(recipe_contexts, analyzer, vocabulary, skip=frozenset()):
+    """Raw term counts as a CSR matrix, adding unseen terms to vocabulary and skipping those in skip"""
+    import numpy as np
+    import scipy.sparse as sp
+    
+    indptr = [0]
+    columns = []
+    values = []
+    for context in recipe_contexts:
+        for term, count in collections.Counter(analyzer(context)).items():
+            if term in skip:
+                continue
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+            values.append(count)
+        indptr.append(len(columns))
+    
+    return sp.csr_matrix(
+        (np.asarray(values, dtype=np.float64), np.asarray(columns, dtype=np.int32), np.asarray(indptr)),
+        shape=(len(indptr) - 1, len(vocabulary))
+    )
+
+def _with_columns(matrix, n_columns):
+    """Widen a CSR matrix to n_columns without copying its arrays"""
+    import scipy.sparse as sp
+    
+    return sp.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], n_columns))
+
+@functools.lru_cache(maxsize=1)
+def _training_analyzer():
+    """The TF-IDF analyzer (tokenizer and n-grams) used to count terms"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    
+    return TfidfVectorizer(**TFIDF_PARAMS).build_analyzer()
+
+def _count_recipe_chunk(chunk):
+    """Preprocess and count one chunk in a training worker; column i of counts is terms[i]"""
+    from logic.model_store import RecipeTable
+    
+    recipe_contexts = build_recipe_contexts(
+        [recipe['name'] for recipe in chunk],
+        [recipe['ingredients'] for recipe in chunk]
+    )
+    vocabulary = {}
+    counts = count_terms(recipe_contexts, _training_analyzer(), vocabulary)
+    return list(vocabulary), counts, RecipeTable.from_records(chunk)
+
+def _map_chunks(func, chunks, workers):
+    """Yield func(chunk) in order from up to `workers` processes, at most two chunks per worker in flight"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    head = [first] if second is None else [first, second]
+    
+    if workers <= 1 or second is None:
+        for chunk in head:
+            yield func(chunk)
+        for chunk in chunks:
+            yield func(chunk)
+        return
+    
+    # Workers come from a fork server rather than a fork of the caller,
+    # which in the web server has other threads running
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        in_flight = collections.deque()
+        for chunk in itertools.chain(head, chunks):
+            in_flight.append(executor.submit(func, chunk))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def fit_recipes(recipe_chunks, directory, workers=None):
+    """Fit the TF-IDF model on recipe chunks into directory; returns (vectorizer, tfidf_matrix, recipes)
+    
+    Chunks go to disk as they are counted, so memory holds a few chunks rather than the catalog.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    from sklearn.preprocessing import normalize
+    from logic import model_store
+    
+    # Download NLTK data before the pool starts, not once in every worker
+    get_nlp_resources()
+    
+    vocabulary = {}
+    document_frequency = np.zeros(0, dtype=np.int64)
+    chunk_sizes = []
+    recipe_writer = model_store.RecipeTableWriter(directory)
+    
+    for terms, counts, recipes in _map_chunks(_count_recipe_chunk, recipe_chunks, workers or TRAIN_WORKERS):
+        # Move the chunk's columns onto the shared vocabulary
+        columns = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in terms], dtype=np.int32)
+        counts = sp.csr_matrix(
+            (counts.data, columns[counts.indices], counts.indptr),
+            shape=(counts.shape[0], len(vocabulary))
+        )
+        document_frequency = np.bincount(counts.indices, minlength=len(vocabulary)) + np.pad(
+            document_frequency, (0, len(vocabulary) - len(document_frequency))
+        )
+        model_store.save_csr(directory, f'counts-{len(chunk_sizes)}', counts)
+        chunk_sizes.append(counts.shape[0])
+        recipe_writer.append(recipes)
+    
+    recipes = recipe_writer.close()
+    if not vocabulary:
+        raise ValueError("empty vocabulary; the recipe catalog has no indexable text")
+    
+    n_terms = len(vocabulary)
+    n_recipes = sum(chunk_sizes)
+    
+    # Sort the vocabulary and prune by document frequency like CountVectorizer
+    sorted_terms = sorted(vocabulary)
+    sorted_columns = np.array([vocabulary[term] for term in sorted_terms])
+    document_frequency = document_frequency[sorted_columns]
+    
+    max_df, min_df = TFIDF_PARAMS['max_df'], TFIDF_PARAMS['min_df']
+    max_count = max_df if isinstance(max_df, int) else max_df * n_recipes
+    min_count = min_df if isinstance(min_df, int) else min_df * n_recipes
+    keep = (document_frequency >= min_count) & (document_frequency <= max_count)
+    if not keep.any():
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+    
+    kept_columns = sorted_columns[keep]
+    sorted_terms = np.array(sorted_terms, dtype=object)
+    vocabulary = {term: column for column, term in enumerate(sorted_terms[keep])}
+    pruned_terms = set(sorted_terms[~keep])
+    
+    # Smoothed IDF; sublinear TF and L2 normalization work row by row, so
+    # each chunk is weighted on its own and appended to the matrix
+    idf = np.log((1 + n_recipes) / (1 + document_frequency[keep])) + 1
+    # Pruning only removes entries, so the stored counts bound the matrix size
+    n_entries = int(document_frequency.sum())
+    index_dtype = np.int32 if max(n_entries, len(vocabulary)) < 2 ** 31 else np.int64
+    tfidf_writer = model_store.CsrWriter(directory, 'tfidf', index_dtype)
+    for chunk, n_rows in enumerate(chunk_sizes):
+        counts = model_store.load_csr(directory, f'counts-{chunk}', (n_rows, n_terms))[:, kept_columns].tocsr()
+        if TFIDF_PARAMS['sublinear_tf']:
+            counts.data = np.log(counts.data) + 1
+        tfidf_writer.append(normalize(counts @ sp.diags(idf)).tocsr())
+        for part in ('data', 'indices', 'indptr'):
+            os.remove(os.path.join(directory, f'counts-{chunk}_{part}.npy'))
+    
+    return make_vectorizer(vocabulary, idf, pruned_terms), tfidf_writer.close(len(vocabulary)), recipes
+
+def train_model(workers=None):
+    """Train the NLM recommendation model using the recipe catalog"""
+    data_path = get_data_path()
+    
     # Check if data file exists
-    if not os.path.exists(DATA_PATH):
-        print(f"Warning: {DATA_PATH} not found. Please create the model.json file with recipe data.")
+    if not os.path.exists(data_path):
+        print(f"Warning: {data_path} not found. Please create the model.json file with recipe data.")
         return False
     
+    from logic import model_store
+    
     try:
-        # Load the JSON data
-        with open(DATA_PATH, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        
-        # Create a DataFrame
-        recipes_df = pd.DataFrame(data['recipes'])
+        # Stream the catalog in chunks and fit the TF-IDF vectors straight
+        # into the directory of the new version
+        with model_store.staging_directory(MODEL_DIR) as directory:
+            tfidf_vectorizer, tfidf_matrix, recipes = fit_recipes(iter_recipe_chunks(data_path), directory, workers)
+            
+            # Create a model dictionary with all necessary components
+            model = {
+                'vectorizer': tfidf_vectorizer,
+                'tfidf_matrix': tfidf_matrix,
+                'postings': model_store.save_transposed_csr(directory, 'postings', tfidf_matrix),
+                'recipes': recipes,
+                'fit_info': {
+                    'fitted_at': time.time(),
+                    'fitted_recipes': len(recipes),
+                    'added_recipes': 0
+                }
+            }
+            
+            # Carry the similar-recipes table forward if the catalog only
+            # grew since the version being replaced
+            previous = model_store.load_artifact(MODEL_DIR)
+            if previous and previous['neighbors'] is not None and recipes.startswith(previous['recipes']):
+                model['neighbors'], model['neighbor_scores'] = extend_neighbors(
+                    previous['neighbors'][0], tfidf_matrix, len(previous['recipes'])
+                )
+            
+            # Save the model
+            save_model(model, directory)
+        print("NLM model trained and saved successfully.")
+        return True
         
-        # Preprocess ingredients and combine into a single string for each recipe
-        recipes_df['ingredients_text'] = recipes_df['ingredients'].apply(
-            lambda x: ' '.join([preprocess_text(ingredient) for ingredient in x])
+    except Exception as e:
+        print(f"Error training model: {e}")
+        return False
+
+def save_model(model, directory=None):
+    """Save a model as a new version in MODEL_DIR, keeping the arrays train_model wrote to directory"""
+    from logic import model_store
+    
+    vocabulary = model['vectorizer'].vocabulary_
+    terms = [None] * len(vocabulary)
+    for term, column in vocabulary.items():
+        terms[column] = term
+    
+    if 'ingredient_bits' in model:
+        ingredient_index = (
+            model['all_ingredients'], model['ingredient_bits'],
+            model['ingredient_counts'], model['ingredient_frequencies']
         )
+    else:
+        ingredient_index = build_ingredient_index(model['recipes'], directory)
+    
+    tfidf_matrix = model['tfidf_matrix'].tocsr()
+    neighbors = (model['neighbors'], model['neighbor_scores']) if 'neighbors' in model else None
+    return model_store.save_artifact(
+        MODEL_DIR,
+        terms,
+        model['vectorizer'].idf_,
+        tfidf_matrix,
+        model['postings'] if 'postings' in model else tfidf_matrix.T.tocsr(),
+        model['recipes'],
+        ingredient_index,
+        model.get('fit_info'),
+        sorted(getattr(model['vectorizer'], 'stop_words_', None) or ()),
+        directory,
+        neighbors
+    )
+
+def _convert_legacy_model():
+    """Save a model.joblib from older versions as the first artifact version, once"""
+    import joblib
+    from logic import model_store
+    
+    with model_store.training_lock(MODEL_DIR):
+        if model_store.read_active_version(MODEL_DIR) is not None:
+            return
+        print(f"Converting {MODEL_PATH} to a saved model version...")
+        save_model(prepare_model(joblib.load(MODEL_PATH)))
+
+def load_saved_model():
+    """Load the active saved model, converting a legacy model.joblib first"""
+    import numpy as np
+    from logic import model_store
+    
+    if model_store.read_active_version(MODEL_DIR) is None:
+        if not os.path.exists(MODEL_PATH):
+            return None
+        _convert_legacy_model()
+    
+    try:
+        artifact = model_store.load_artifact(MODEL_DIR)
+    except FileNotFoundError:
+        # The version was pruned while being read, so a newer one is active
+        artifact = model_store.load_artifact(MODEL_DIR)
+    if artifact is None:
+        return None
+    
+    vocabulary = {term: column for column, term in enumerate(artifact['terms'])}
+    model = {
+        'vectorizer': make_vectorizer(vocabulary, np.array(artifact['idf']), artifact['pruned_terms']),
+        'tfidf_matrix': artifact['tfidf_matrix'],
+        'postings': artifact['postings'],
+        'recipes': artifact['recipes'],
+        'fit_info': artifact['fit_info'],
+        'artifact_version': artifact['artifact_version']
+    }
+    if artifact['neighbors'] is not None:
+        model['neighbors'], model['neighbor_scores'] = artifact['neighbors']
+    if artifact['ingredient_index'] is not None:
+        (model['all_ingredients'], model['ingredient_bits'],
+         model['ingredient_counts'], model['ingredient_frequencies']) = artifact['ingredient_index']
+    return model
+
+def _top_neighbors(similarity, candidates, k):
+    """The k best-scoring candidates of each row, best first, padded with -1 and 0"""
+    import numpy as np
+    
+    candidates = np.broadcast_to(candidates, similarity.shape)
+    if similarity.shape[1] < k:
+        padding = k - similarity.shape[1]
+        similarity = np.pad(similarity, ((0, 0), (0, padding)))
+        candidates = np.pad(candidates, ((0, 0), (0, padding)), constant_values=-1)
+    
+    top = np.argpartition(similarity, similarity.shape[1] - k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(similarity, top, axis=1)
+    top = np.take_along_axis(candidates, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    
+    found = top_scores > 0
+    return np.where(found, top, -1), np.where(found, top_scores, 0)
+
+def compute_neighbors(tfidf_matrix, k=NEIGHBOR_COUNT, block_bytes=NEIGHBOR_BLOCK_BYTES, rows=None):
+    """Top k similar recipes of every row (or rows=(start, end)), padded with -1 and 0"""
+    import numpy as np
+    import scipy.sparse as sp
+    
+    matrix = tfidf_matrix.tocsr()
+    n_recipes = matrix.shape[0]
+    start, end = rows or (0, n_recipes)
+    k = min(k, max(n_recipes - 1, 0))
+    neighbors = np.full((end - start, k), -1, dtype=np.int32)
+    scores = np.zeros((end - start, k), dtype=np.float32)
+    if k == 0 or start == end:
+        return neighbors, scores
+    
+    # Only the values are copied; the index arrays stay memory-mapped
+    matrix = sp.csr_matrix((matrix.data.astype(np.float32), matrix.indices, matrix.indptr), shape=matrix.shape)
+    block_rows = max(1, block_bytes // (12 * n_recipes))
+    for block_start in range(start, end, block_rows):
+        block_end = min(block_start + block_rows, end)
+        similarity = np.ascontiguousarray((matrix @ matrix[block_start:block_end].toarray().T).T)
         
-        # Create recipe descriptions that combine name and ingredients for better context
-        recipes_df['recipe_context'] = recipes_df.apply(
-            lambda x: f"{preprocess_text(x['name'])} {x['ingredients_text']}", axis=1
-        )
+        # A recipe is not its own neighbor
+        similarity[np.arange(block_end - block_start), np.arange(block_start, block_end)] = 0
+        
+        (neighbors[block_start - start:block_end - start],
+         scores[block_start - start:block_end - start]) = _top_neighbors(similarity, np.arange(n_recipes), k)
+    
+    return neighbors, scores
+
+def _neighbor_range(task):
+    """compute_neighbors for a range of rows of a saved TF-IDF matrix, in a training worker"""
+    from logic import model_store
+    
+    directory, shape, rows = task
+    return compute_neighbors(model_store.load_csr(directory, 'tfidf', shape), rows=rows)
+
+def compute_neighbor_table(directory, shape, workers=None):
+    """compute_neighbors for the TF-IDF matrix saved in directory, split across `workers` processes"""
+    import numpy as np
+    
+    # A few ranges per worker, so the last ones don't leave the others idle
+    step = max(1, -(-shape[0] // (4 * (workers or TRAIN_WORKERS))))
+    ranges = [
+        (directory, shape, (start, min(start + step, shape[0])))
+        for start in range(0, max(shape[0], 1), step)
+    ]
+    parts = list(_map_chunks(_neighbor_range, ranges, workers or TRAIN_WORKERS))
+    return np.vstack([part[0] for part in parts]), np.vstack([part[1] for part in parts])
+
+def extend_neighbors(neighbors, tfidf_matrix, n_old, k=NEIGHBOR_COUNT, block_bytes=NEIGHBOR_BLOCK_BYTES):
+    """Carry a similar-recipes table forward to a matrix with rows appended
+    
+    Old neighbors are rescored and merged with the new rows; other pairs of old recipes wait for a full build.
+    """
+    import numpy as np
+    
+    matrix = tfidf_matrix.tocsr()
+    n_recipes = matrix.shape[0]
+    k = min(k, max(n_recipes - 1, 0))
+    added_neighbors, added_scores = compute_neighbors(matrix, k, block_bytes, (n_old, n_recipes))
+    
+    kept = np.asarray(neighbors)
+    added = matrix[n_old:].T.tocsr()
+    width = kept.shape[1] + (n_recipes - n_old)
+    old_neighbors = np.full((n_old, k), -1, dtype=np.int32)
+    old_scores = np.zeros((n_old, k), dtype=np.float32)
+    
+    # Per row: the scores and their partition indices, and the two sparse
+    # rows gathered for each old pair along with their product
+    row_bytes = 16 * width + 36 * kept.shape[1] * max(1, matrix.nnz // max(n_recipes, 1))
+    block_rows = max(1, block_bytes // max(row_bytes, 1))
+    for start in range(0, n_old, block_rows):
+        end = min(start + block_rows, n_old)
+        candidates = kept[start:end]
+        
+        # Rescore the old neighbors pair by pair under the new IDF
+        rows = np.repeat(np.arange(start, end), candidates.shape[1])
+        pairs = np.where(candidates >= 0, candidates, 0).ravel()
+        rescored = np.asarray(matrix[rows].multiply(matrix[pairs]).sum(axis=1)).reshape(candidates.shape)
+        rescored[candidates < 0] = 0
         
-        # Create TF-IDF vectors with advanced parameters
-        tfidf_vectorizer = TfidfVectorizer(
-            min_df=1,
-            max_df=0.95,
-            max_features=None,
-            ngram_range=(1, 2),
-            use_idf=True,
-            smooth_idf=True,
-            sublinear_tf=True
+        similarity = np.hstack([rescored, (matrix[start:end] @ added).toarray()])
+        candidates = np.hstack([candidates, np.broadcast_to(np.arange(n_old, n_recipes), (end - start, n_recipes - n_old))])
+        old_neighbors[start:end], old_scores[start:end] = _top_neighbors(similarity, candidates, k)
+    
+    return np.vstack([old_neighbors, added_neighbors]), np.vstack([old_scores, added_scores])
+
+def build_neighbor_table():
+    """Compute and store the similar-recipes table of the active saved model"""
+    from logic import model_store
+    
+    artifact = model_store.load_artifact(MODEL_DIR)
+    if artifact is None:
+        print("No saved model found. Train the model first.")
+        return False
+    
+    start = time.monotonic()
+    version = artifact['artifact_version']
+    neighbors, scores = compute_neighbor_table(os.path.join(MODEL_DIR, version), artifact['tfidf_matrix'].shape)
+    model_store.save_neighbors(MODEL_DIR, version, neighbors, scores)
+    print(f"Similar-recipes table for {len(neighbors)} recipes saved in {time.monotonic() - start:.1f}s.")
+    return True
+
+def validate_recipe(recipe):
+    """Return an error message if a recipe is malformed, else None"""
+    if not isinstance(recipe, dict):
+        return "Recipe must be an object"
+    if not isinstance(recipe.get('name'), str) or not recipe['name'].strip():
+        return "Recipe name is required"
+    ingredients = recipe.get('ingredients')
+    if not isinstance(ingredients, list) or not ingredients or not all(isinstance(i, str) for i in ingredients):
+        return f"Recipe '{recipe['name']}' needs a non-empty list of ingredients"
+    if not isinstance(recipe.get('instructions'), str):
+        return f"Recipe '{recipe['name']}' needs instructions"
+    return None
+
+def extend_model(model, new_recipes):
+    """Return a new model with recipes appended, without refitting
+    
+    Existing rows are only reweighted to the new IDF; terms pruned by max_df stay out until the next refit.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    from sklearn.preprocessing import normalize
+    from logic.model_store import RecipeTable
+    
+    recipe_contexts = build_recipe_contexts(
+        [recipe['name'] for recipe in new_recipes],
+        [recipe['ingredients'] for recipe in new_recipes]
+    )
+    
+    old_vectorizer = model['vectorizer']
+    old_matrix = model['tfidf_matrix'].tocsr()
+    analyzer = old_vectorizer.build_analyzer()
+    vocabulary = dict(old_vectorizer.vocabulary_)
+    
+    # Term counts of the new recipes, growing the vocabulary as needed
+    pruned_terms = getattr(old_vectorizer, 'stop_words_', None) or set()
+    new_tf = count_terms(recipe_contexts, analyzer, vocabulary, pruned_terms)
+    if TFIDF_PARAMS['sublinear_tf']:
+        new_tf.data = np.log(new_tf.data) + 1
+    
+    n_terms = len(vocabulary)
+    new_tf = _with_columns(new_tf, n_terms)
+    old_matrix = _with_columns(old_matrix, n_terms)
+    
+    # Smoothed IDF over the combined catalog
+    n_recipes = old_matrix.shape[0] + new_tf.shape[0]
+    document_frequency = (np.bincount(old_matrix.indices, minlength=n_terms) +
+                          np.bincount(new_tf.indices, minlength=n_terms))
+    idf = np.log((1 + n_recipes) / (1 + document_frequency)) + 1
+    
+    # Existing rows only need their IDF factor swapped before renormalizing
+    old_idf = np.ones(n_terms)
+    old_idf[:len(old_vectorizer.idf_)] = old_vectorizer.idf_
+    tfidf_matrix = normalize(sp.vstack([
+        old_matrix @ sp.diags(idf / old_idf),
+        new_tf @ sp.diags(idf)
+    ]).tocsr())
+    
+    vectorizer = make_vectorizer(vocabulary, idf, pruned_terms)
+    
+    fit_info = dict(model.get('fit_info') or {
+        'fitted_at': time.time(),
+        'fitted_recipes': old_matrix.shape[0],
+        'added_recipes': 0
+    })
+    fit_info['added_recipes'] += len(new_recipes)
+    
+    extended = {
+        'vectorizer': vectorizer,
+        'tfidf_matrix': tfidf_matrix,
+        'recipes': RecipeTable.concat([model['recipes'], RecipeTable.from_records(new_recipes)]),
+        'fit_info': fit_info
+    }
+    if 'neighbors' in model:
+        extended['neighbors'], extended['neighbor_scores'] = extend_neighbors(
+            model['neighbors'], tfidf_matrix, old_matrix.shape[0]
         )
-        tfidf_matrix = tfidf_vectorizer.fit_transform(recipes_df['recipe_context'])
+    return extended
+
+def _refit_due(model):
+    """Whether incremental updates have drifted far enough for a full refit"""
+    fit_info = model.get('fit_info')
+    if not fit_info or not fit_info['added_recipes']:
+        return False
+    
+    drift = fit_info['added_recipes'] / max(fit_info['fitted_recipes'], 1)
+    return drift > REFIT_DRIFT_THRESHOLD or time.time() - fit_info['fitted_at'] > REFIT_INTERVAL
+
+def _format_recipe(recipe):
+    """A recipe laid out like the entries of model.json"""
+    fields = [
+        f"      {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+        for key, value in recipe.items()
+    ]
+    return "    {\n" + ",\n".join(fields) + "\n    }"
+
+def _append_recipe_data(new_recipes):
+    """Append recipes to the catalog file without rewriting the recipes already in it"""
+    if get_data_path() == DATA_JSONL_PATH:
+        with open(DATA_JSONL_PATH, 'a', encoding='utf-8') as file:
+            for recipe in new_recipes:
+                file.write(json.dumps(recipe, ensure_ascii=False) + '\n')
+        return
+    
+    with open(DATA_PATH, 'r+b') as file:
+        data = json.load(file)
+        # The recipes list has to be the last thing in the file
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(size - 4096, 0))
+        start = file.tell()
+        tail = file.read()
+        end = re.search(rb'(\S)(\s*\]\s*\}\s*)$', tail)
         
-        # Create a model dictionary with all necessary components
-        model = {
-            'vectorizer': tfidf_vectorizer,
-            'tfidf_matrix': tfidf_matrix,
-            'recipes': recipes_df,
-            'ingredients_vocab': tfidf_vectorizer.get_feature_names_out()
-        }
+        if list(data)[-1:] == ['recipes'] and end:
+            entries = ",\n".join(_format_recipe(recipe) for recipe in new_recipes).encode('utf-8')
+            if end.group(1) == b'[':
+                # The list was empty
+                insert = b"\n" + entries + b"\n  " + end.group(2).lstrip()
+            else:
+                insert = b",\n" + entries + end.group(2)
+            file.seek(start + end.end(1))
+            file.write(insert)
+            file.truncate()
+            return
+    
+    # Any other layout is written out in full
+    data['recipes'].extend(new_recipes)
+    temp_path = DATA_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    os.replace(temp_path, DATA_PATH)
+
+def add_recipes(new_recipes):
+    """Add recipes to the live model incrementally; returns (success, message, refit_scheduled)"""
+    from logic import model_store
+    
+    for recipe in new_recipes:
+        error = validate_recipe(recipe)
+        if error:
+            return False, error, False
+    
+    with _model_update_lock:
+        model = load_model()
+        if not model:
+            return False, "Recommendation model is not available", False
         
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+        # Hold off the file watcher while the catalog and the saved model are
+        # both being rewritten, so it does not start a full retrain
+        with _model_lock:
+            if _model_state['reloading']:
+                return False, "Model is being rebuilt, please retry shortly", False
+            _model_state['reloading'] = True
         
-        # Save the model
-        joblib.dump(model, MODEL_PATH)
-        print("NLM model trained and saved successfully.")
-        return True
+        try:
+            with model_store.training_lock(MODEL_DIR):
+                # Extend the saved model: another worker may have saved a
+                # newer version, or a similar-recipes table for this one
+                model = load_saved_model()
+                _append_recipe_data(new_recipes)
+                save_model(extend_model(model, new_recipes))
+            
+            # Serve the saved, memory-mapped copy rather than the one built here
+            new_model, signature = _read_model()
+            _swap_model(new_model, signature)
+        finally:
+            _model_state['reloading'] = False
+    
+    if not new_model:
+        return False, "Recipes were saved but the updated model failed to load", False
+    
+    refit_scheduled = _refit_due(new_model) and _start_background_reload(force_train=True)
+    return True, f"Added {len(new_recipes)} recipes", refit_scheduled
+
+def build_ingredient_matcher(ingredients):
+    """Build a token trie over the ingredient names; 'partial' maps shorter runs to their ingredient"""
+    root = {'children': {}, 'ingredient': None}
+    partial = {}
+    terms = {}
+    
+    # Ingredients arrive sorted, so the first one stored for a key wins,
+    # which matches the old linear scan over the sorted vocabulary
+    for ingredient, normalized in zip(ingredients, preprocess_texts(ingredients)):
+        tokens = normalized.split()
+        if not tokens:
+            continue
+        terms[ingredient] = normalized
         
-    except Exception as e:
-        print(f"Error training model: {e}")
-        return False
+        node = root
+        for token in tokens:
+            node = node['children'].setdefault(token, {'children': {}, 'ingredient': None})
+        if node['ingredient'] is None:
+            node['ingredient'] = ingredient
+        
+        for start in range(len(tokens)):
+            for end in range(start + 1, len(tokens) + 1):
+                if end - start < len(tokens):
+                    partial.setdefault(' '.join(tokens[start:end]), ingredient)
+    
+    return {'root': root, 'partial': partial, 'terms': terms}
 
-def load_model():
-    """Load the trained model"""
-    if not os.path.exists(MODEL_PATH):
-        print("Model not found. Training new model...")
-        if not train_model():
-            # Return a dummy model if training fails
-            return None
+def match_ingredients(matcher, text):
+    """Find every known ingredient in normalized text in one pass, longest match first"""
+    tokens = text.split()
+    found = []
+    position = 0
+    
+    while position < len(tokens):
+        node = matcher['root']['children'].get(tokens[position])
+        match, match_end = None, position + 1
+        cursor = position
+        
+        while node is not None:
+            cursor += 1
+            if node['ingredient'] is not None:
+                match, match_end = node['ingredient'], cursor
+            if cursor == len(tokens):
+                break
+            node = node['children'].get(tokens[cursor])
+        
+        if match is not None:
+            found.append(match)
+        position = match_end
+    
+    return found
+
+def _delete_levels(word, max_distance):
+    """Yield the strings made by deleting 0, 1, ... max_distance characters from word, one set per count"""
+    frontier = {word}
+    yield frontier
+    for _ in range(max_distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        yield frontier
+
+def _edit_distance(a, b):
+    """Optimal string alignment distance: edits plus adjacent transpositions"""
+    table = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[-1][-1]
+
+def _allowed_edit_distance(word, max_distance):
+    """Edits tolerated in a word: none up to 5 letters, 1 up to 8, then 2
+    
+    Short words are often real words one edit from an ingredient ("malam", "salam").
+    """
+    return min(max_distance, (len(word) - 3) // 3)
+
+def build_typo_index(ingredient_terms, frequencies, max_distance=TYPO_MAX_EDIT_DISTANCE):
+    """Build a SymSpell-style deletion index over the ingredient words, weighted by recipe count"""
+    weights = {}
+    for normalized, frequency in zip(ingredient_terms, frequencies):
+        for word in normalized.split():
+            weights[word] = weights.get(word, 0) + int(frequency)
+    
+    deletes = {}
+    for word in weights:
+        for variant in set().union(*_delete_levels(word, max_distance)):
+            deletes.setdefault(variant, []).append(word)
+    
+    return {'weights': weights, 'deletes': deletes, 'max_distance': max_distance}
+
+def correct_word(typo_index, word):
+    """The closest ingredient word to word, or word itself if none is close enough"""
+    weights = typo_index['weights']
+    if word in weights:
+        return word
+    allowed = _allowed_edit_distance(word, typo_index['max_distance'])
+    if allowed <= 0:
+        return word
+    
+    best = None
+    checked = set()
+    for deleted, variants in enumerate(_delete_levels(word, allowed)):
+        # Candidates reached with more deletions can't be any closer
+        if best is not None and deleted > best[0]:
+            break
+        for variant in variants:
+            for candidate in typo_index['deletes'].get(variant, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                
+                # Both words reduce to variant, which bounds their distance from below
+                lower_bound = max(deleted, len(candidate) - len(variant))
+                if lower_bound > allowed or (best is not None and lower_bound > best[0]):
+                    continue
+                if variant == word or variant == candidate:
+                    # One word is the other with letters added: the bound is exact
+                    distance = lower_bound
+                else:
+                    distance = _edit_distance(word, candidate)
+                
+                if distance <= allowed:
+                    key = (distance, -weights[candidate], candidate)
+                    if best is None or key < best:
+                        best = key
+    return word if best is None else best[2]
+
+def correct_typos(typo_index, text):
+    """Replace each word of normalized text that is not an ingredient word by its closest match"""
+    return ' '.join([correct_word(typo_index, word) for word in text.split()])
+
+def build_ingredient_suggester(ingredients, frequencies):
+    """Build a sorted prefix index over every word of the ingredient names for autocomplete"""
+    frequencies = [int(frequency) for frequency in frequencies]
+    entries = []
+    for column, ingredient in enumerate(ingredients):
+        words = ingredient.lower().split()
+        for start in range(len(words)):
+            entries.append((' '.join(words[start:]), column))
+    entries.sort()
+    
+    return {
+        'keys': [key for key, _ in entries],
+        'columns': [column for _, column in entries],
+        'frequencies': frequencies,
+        # Most used first, ties in alphabetical order
+        'popular': sorted(range(len(ingredients)), key=lambda column: (-frequencies[column], column))
+    }
+
+def build_ingredient_index(recipes, directory=None, block_size=10000):
+    """Pack recipe ingredients into bitsets; returns (ingredients, bits, counts, frequencies)
+    
+    bits has one row per bitset byte and one column per recipe; with directory it is written there.
+    """
+    import numpy as np
+    from array import array
+    
+    # Single pass with ids in first-seen order, remapped to sorted order below
+    provisional = {}
+    columns = array('i')
+    counts = array('i')
+    for ingredients in recipes.iter_ingredients():
+        distinct = {provisional.setdefault(ingredient, len(provisional)) for ingredient in ingredients}
+        columns.extend(distinct)
+        counts.append(len(distinct))
+    
+    all_ingredients = sorted(provisional)
+    sorted_column = np.empty(len(all_ingredients), dtype=np.int32)
+    sorted_column[[provisional[ingredient] for ingredient in all_ingredients]] = np.arange(len(all_ingredients))
+    columns = sorted_column[np.frombuffer(columns, dtype=np.int32)]
+    counts = np.frombuffer(counts, dtype=np.int32).copy()
+    
+    shape = ((len(all_ingredients) + 7) // 8, len(recipes))
+    if directory is None:
+        bits = np.zeros(shape, dtype=np.uint8)
+    else:
+        bits = np.lib.format.open_memmap(
+            os.path.join(directory, 'ingredient_bits.npy'), mode='w+', dtype=np.uint8, shape=shape
+        )
+    
+    # A block of recipes at a time, so the temporary index arrays stay small
+    frequencies = np.zeros(len(all_ingredients), dtype=np.int64)
+    ends = np.cumsum(counts, dtype=np.int64)
+    for start in range(0, len(counts), block_size):
+        stop = min(start + block_size, len(counts))
+        block = columns[ends[start] - counts[start]:ends[stop - 1]]
+        rows = np.repeat(np.arange(start, stop), counts[start:stop])
+        np.bitwise_or.at(bits, (block >> 3, rows), (0x80 >> (block & 7)).astype(np.uint8))
+        frequencies += np.bincount(block, minlength=len(all_ingredients))
+    if directory is not None:
+        bits.flush()
+    return all_ingredients, bits, counts, frequencies.astype(np.int32)
+
+def prepare_model(model):
+    """Precompute the lookup structures used on the request path"""
+    from logic.model_store import RecipeTable
+    
+    if model is None:
+        return None
+    
+    # Models pickled by older versions keep recipes in a DataFrame
+    if not isinstance(model['recipes'], RecipeTable):
+        model['recipes'] = RecipeTable.from_records(model['recipes'].to_dict('records'))
+    
+    # Saved models ship the ingredient bitsets; build them for older ones
+    if 'ingredient_bits' not in model:
+        (model['all_ingredients'], model['ingredient_bits'],
+         model['ingredient_counts'], model['ingredient_frequencies']) = build_ingredient_index(model['recipes'])
+    model['ingredient_columns'] = {ingredient: column for column, ingredient in enumerate(model['all_ingredients'])}
+    model['ingredient_matcher'] = build_ingredient_matcher(model['all_ingredients'])
+    model['ingredient_suggester'] = build_ingredient_suggester(
+        model['all_ingredients'], model['ingredient_frequencies']
+    )
+    model['typo_index'] = build_typo_index(
+        [model['ingredient_matcher']['terms'].get(ingredient, '') for ingredient in model['all_ingredients']],
+        model['ingredient_frequencies']
+    )
+    
+    # Inverted index: one row per term listing the recipes that contain it.
+    # Saved models ship it memory-mapped; build it for older ones
+    if 'postings' not in model:
+        model['postings'] = model['tfidf_matrix'].T.tocsr()
+    return model
+
+def _file_signature(path):
+    """Return (mtime, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _model_signature():
+    """Signature of the files the model is built from"""
+    from logic import model_store
+    
+    return (
+        _file_signature(model_store.get_active_path(MODEL_DIR)),
+        _file_signature(MODEL_PATH),
+        _file_signature(DATA_PATH),
+        _file_signature(DATA_JSONL_PATH)
+    )
+
+def _training_reason():
+    """Why the saved model has to be trained before loading, or None if it is current"""
+    from logic import model_store
+    
+    model_signature = _file_signature(model_store.get_active_path(MODEL_DIR)) or _file_signature(MODEL_PATH)
+    data_signature = _file_signature(get_data_path())
+    
+    if model_signature is None:
+        return "Model not found. Training new model..."
+    if data_signature and data_signature[0] > model_signature[0]:
+        return "Recipe data changed. Retraining model..."
+    return None
+
+def _read_model(force_train=False):
+    """Read the model from disk, retraining first under the training lock if it is missing or stale"""
+    from logic import model_store
+    
+    if force_train or _training_reason():
+        with model_store.training_lock(MODEL_DIR):
+            # Checked again under the lock: another worker may have trained
+            reason = "Refitting model on the full catalog..." if force_train else _training_reason()
+            if reason:
+                print(reason)
+                train_model(SERVER_TRAIN_WORKERS)
     
+    # Take the signature before reading so a write that races with the load
+    # is picked up by the next check
+    signature = _model_signature()
     try:
-        return joblib.load(MODEL_PATH)
+        model = prepare_model(load_saved_model())
+        if model is not None:
+            warm_model(model)
+        return model, signature
     except Exception as e:
         print(f"Error loading model: {e}")
-        return None
+        return None, signature
 
-def parse_user_query(query):
-    """Parse natural language query to extract ingredients"""
-    # Convert to lowercase and clean up
-    query = query.lower()
-    
-    # Common phrases indicating ingredients
-    ingredient_indicators = [
-        "i have", "we have", "got", "using", "with", "use", 
-        "ingredients:", "ingredients are", "ingredients include",
-        "saya punya", "aku punya", "bahan:", "bahan-bahan:"
+def _recommendation_cache_key(model, query_text, ingredients_list, num_recommendations, mode='tfidf'):
+    """Canonical cache key, so "nasi dan telur" and "telur, nasi" share an entry"""
+    if ingredients_list or mode == 'coverage':
+        return (model['version'], mode, 'ingredients', tuple(sorted(set(ingredients_list))), num_recommendations)
+    return (model['version'], mode, 'text', query_text, num_recommendations)
+
+def _recommendation_cache_get(key):
+    """Return cached ranked results, or None on a miss"""
+    with _recommendation_cache_lock:
+        entry = _recommendation_cache.get(key)
+        if entry is None:
+            _recommendation_cache_stats['misses'] += 1
+            return None
+        
+        expires_at, ranked = entry
+        if expires_at < time.monotonic():
+            del _recommendation_cache[key]
+            _recommendation_cache_stats['expired'] += 1
+            _recommendation_cache_stats['misses'] += 1
+            return None
+        
+        _recommendation_cache.move_to_end(key)
+        _recommendation_cache_stats['hits'] += 1
+        return ranked
+
+def _recommendation_cache_put(key, ranked):
+    """Store ranked results, evicting the least recently used entries"""
+    if RECOMMENDATION_CACHE_SIZE <= 0:
+        return
+    
+    with _recommendation_cache_lock:
+        _recommendation_cache[key] = (time.monotonic() + RECOMMENDATION_CACHE_TTL, ranked)
+        _recommendation_cache.move_to_end(key)
+        while len(_recommendation_cache) > RECOMMENDATION_CACHE_SIZE:
+            _recommendation_cache.popitem(last=False)
+            _recommendation_cache_stats['evictions'] += 1
+
+def clear_recommendation_cache():
+    """Drop all cached recommendation results"""
+    with _recommendation_cache_lock:
+        _recommendation_cache.clear()
+
+def _drop_other_model_versions(version):
+    """Drop cached results of every model but one"""
+    with _recommendation_cache_lock:
+        for key in [key for key in _recommendation_cache if key[0] != version]:
+            del _recommendation_cache[key]
+
+def _warmup_queries(model):
+    """Queries to prime a new model with: recent cache entries first, then popular ingredients"""
+    with _recommendation_cache_lock:
+        hot = [key[1:] for key in reversed(_recommendation_cache)]
+    
+    ingredient_terms = model['ingredient_matcher']['terms']
+    popular = [model['all_ingredients'][column] for column in model['ingredient_suggester']['popular'][:WARMUP_POPULAR_INGREDIENTS]]
+    samples = [(mode, 'ingredients', (ingredient,), 5) for ingredient in popular for mode in RANKING_MODES]
+    samples += [(mode, 'ingredients', tuple(sorted(pair)), 5) for pair in zip(popular, popular[1:]) for mode in RANKING_MODES]
+    
+    queries = []
+    for mode, kind, query, num_recommendations in dict.fromkeys(hot + samples):
+        if kind == 'text':
+            queries.append((mode, [], query, num_recommendations))
+        elif all(ingredient in ingredient_terms for ingredient in query):
+            # Ingredients the new model no longer knows can't be replayed
+            query_text = ' '.join([ingredient_terms[ingredient] for ingredient in query])
+            queries.append((mode, list(query), query_text, num_recommendations))
+    return queries[:WARMUP_QUERIES]
+
+def warm_model(model):
+    """Rank the warm-up queries on a new model before it serves; errors propagate so it is never published"""
+    start = time.monotonic()
+    model['version'] = next(_model_versions)
+    
+    # Exercise the parser, matcher and typo index once
+    extract_ingredients_from_text(' dan '.join(get_all_ingredients(model)[:3]), model)
+    
+    queries = _warmup_queries(model)
+    for mode, ingredients_list, query_text, num_recommendations in queries:
+        input_vector = model['vectorizer'].transform([query_text]) if mode == 'tfidf' else None
+        ranked = rank_recipes(model, input_vector, ingredients_list, num_recommendations, mode)
+        cache_key = _recommendation_cache_key(model, query_text, ingredients_list, num_recommendations, mode)
+        _recommendation_cache_put(cache_key, ranked)
+    
+    print(f"Warmed up model {model.get('artifact_version', model['version'])} "
+          f"with {len(queries)} queries in {time.monotonic() - start:.2f}s")
+    return len(queries)
+
+def get_recommendation_cache_stats():
+    """Cache counters for monitoring"""
+    with _recommendation_cache_lock:
+        stats = dict(_recommendation_cache_stats)
+        stats['size'] = len(_recommendation_cache)
+    
+    stats['max_size'] = RECOMMENDATION_CACHE_SIZE
+    stats['ttl_seconds'] = RECOMMENDATION_CACHE_TTL
+    return stats
+
+def _publish_model(model, signature):
+    """Make a loaded model the current one (caller holds _model_lock)"""
+    _model_state['signature'] = signature
+    if model is None:
+        # Keep serving the previous model; the signature is recorded so a
+        # broken file is not reloaded again until it changes
+        return
+    if 'version' not in model:
+        model['version'] = next(_model_versions)
+    _model_state['version'] = model['version']
+    _model_state['model'] = model
+    
+    # Results of other models can never be served again; the ones the
+    # warm-up cached for this model stay
+    _drop_other_model_versions(model['version'])
+
+def _swap_model(model, signature):
+    """Publish a freshly loaded model to all request threads"""
+    with _model_lock:
+        _publish_model(model, signature)
+
+def _reload_model_in_background(force_train=False):
+    """Rebuild the model off the request path and swap it in when ready"""
+    try:
+        model, signature = _read_model(force_train)
+        _swap_model(model, signature)
+    finally:
+        _model_state['reloading'] = False
+
+def _start_background_reload(force_train=False):
+    """Start a background reload unless one is already running"""
+    with _model_lock:
+        if _model_state['reloading']:
+            return False
+        _model_state['reloading'] = True
+    
+    threading.Thread(target=_reload_model_in_background, args=(force_train,), daemon=True).start()
+    return True
+
+def _check_model_files():
+    """Start a background reload if the model files changed on disk"""
+    now = time.monotonic()
+    if now - _model_state['checked_at'] < MODEL_CHECK_INTERVAL:
+        return
+    
+    with _model_lock:
+        if now - _model_state['checked_at'] < MODEL_CHECK_INTERVAL or _model_state['reloading']:
+            return
+        _model_state['checked_at'] = now
+        if _model_signature() == _model_state['signature']:
+            return
+    
+    _start_background_reload()
+
+def load_model():
+    """Return the shared model, loading it once per process"""
+    if _model_state['model'] is None:
+        # First use: load synchronously, other threads wait for the same load
+        with _model_lock:
+            if _model_state['model'] is None:
+                _publish_model(*_read_model())
+                _model_state['checked_at'] = time.monotonic()
+        return _model_state['model']
+    
+    _check_model_files()
+    return _model_state['model']
+
+def list_model_versions():
+    """Saved model versions, oldest first, with the active one marked"""
+    from logic import model_store
+    
+    active = model_store.read_active_version(MODEL_DIR)
+    return [
+        {'version': version, 'active': version == active}
+        for version in model_store.list_versions(MODEL_DIR)
     ]
+
+def rollback_model():
+    """Switch every worker back to the previous model version; returns it, or None if there is none"""
+    from logic import model_store
     
-    # Remove these phrases
-    for indicator in ingredient_indicators:
-        query = query.replace(indicator, "")
+    return model_store.rollback(MODEL_DIR)
+
+def activate_model_version(version):
+    """Switch every worker to a saved model version"""
+    from logic import model_store
     
-    # Extract individual ingredients
-    ingredients = []
+    model_store.activate_version(MODEL_DIR, version)
+
+def warm_up():
+    """Load NLTK and the model ahead of the first request; safe to call from a background thread"""
+    start = time.monotonic()
+    get_nlp_resources()
+    model = load_model()
+    print(f"AI model warm-up finished in {time.monotonic() - start:.2f}s")
+    return model is not None
+
+# Lead-in phrases, connectors between ingredients and vague amounts, in
+# English and Indonesian; each one separates ingredients in a query
+QUERY_INDICATORS = [
+    "i have", "we have", "got", "using", "with", "use",
+    "ingredients:", "ingredients are", "ingredients include",
+    "saya punya", "aku punya", "bahan:", "bahan-bahan:"
+]
+QUERY_CONNECTORS = ["and", "or", "plus", "dan", "serta", "atau", "dengan", "juga"]
+QUERY_QUANTITY_WORDS = ["some", "a little", "a few", "secukupnya", "sedikit", "beberapa"]
+
+# Units dropped together with the number in front of them, e.g. "2 siung"
+QUERY_UNITS = [
+    "g", "gr", "gram", "grams", "kg", "mg", "ml", "l", "liter", "litre", "ons",
+    "sdm", "sdt", "tbsp", "tsp", "cup", "cups", "gelas", "butir", "siung", "buah",
+    "lembar", "batang", "ikat", "potong", "ekor", "bungkus", "sachet", "pcs",
+    "piece", "pieces", "slice", "slices", "clove", "cloves", "x"
+]
+
+def _phrase_pattern(phrases):
+    """Regex alternation for phrases, factored into a prefix trie so no phrase is retried at each word"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = phrase[-1].isalnum()
     
-    # Split by common separators
-    for item in re.split(r'[,;.]|and|dan', query):
-        item = item.strip()
-        if item and len(item) > 1:  # Avoid empty or single-letter entries
-            ingredients.append(item)
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if '' in node:
+            branches.append(r'(?!\w)' if node[''] else '')
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
     
-    return ingredients
+    first_chars = ''.join(sorted(re.escape(char) for char in trie))
+    return '(?=[' + first_chars + '])' + emit(trie)
+
+def _compile_query_parser():
+    """One pattern that captures the runs of words between amounts and connectors in a single pass"""
+    keywords = _phrase_pattern(QUERY_INDICATORS + QUERY_CONNECTORS + QUERY_QUANTITY_WORDS)
+    word = r"[^\W\d_]+"
+    return re.compile(
+        r'\d+(?:[.,/]\d+)?\s*' + _phrase_pattern(QUERY_UNITS) + '?'
+        r'|(?<!\w)' + keywords +
+        r"|(" + word + r"(?:[ \t'-]+(?!" + keywords + r')' + word + r')*)'
+    )
+
+_QUERY_PARSER = _compile_query_parser()
+
+def parse_user_query(query):
+    """Parse natural language query to extract ingredients"""
+    # Avoid single-letter entries
+    return [item for item in _QUERY_PARSER.findall(query.lower()) if len(item) > 1]
+
+def _match_fragment(matcher, fragment):
+    """Whole ingredients mentioned in a fragment, else the ingredient the fragment is part of"""
+    matches = match_ingredients(matcher, fragment)
+    if not matches and fragment in matcher['partial']:
+        matches = [matcher['partial'][fragment]]
+    return matches
 
-def extract_ingredients_from_text(text):
+def extract_ingredients_from_text(text, model=None):
     """Extract ingredients from natural language text input"""
     # Try to parse ingredients from query
     parsed_ingredients = parse_user_query(text)
     
     # Load model to get ingredient vocabulary
-    model = load_model()
+    if model is None:
+        model = load_model()
     if not model:
         return []
     
-    all_ingredients = get_all_ingredients()
+    matcher = model['ingredient_matcher']
     
     # Match parsed ingredients against known ingredients
     confirmed_ingredients = []
     
-    for parsed_item in parsed_ingredients:
-        parsed_item = preprocess_text(parsed_item)
+    for parsed_item in preprocess_texts(parsed_ingredients):
+        matches = _match_fragment(matcher, parsed_item)
+        if not matches:
+            # Only a fragment that matches nothing may be misspelled, e.g.
+            # "bawnag putih"; its correction counts only if it then matches
+            corrected = correct_typos(model['typo_index'], parsed_item)
+            if corrected != parsed_item:
+                matches = _match_fragment(matcher, corrected)
         
-        # Check for exact matches
-        for known_ingredient in all_ingredients:
-            if parsed_item in preprocess_text(known_ingredient) or preprocess_text(known_ingredient) in parsed_item:
-                confirmed_ingredients.append(known_ingredient)
-                break
+        for ingredient in matches:
+            if ingredient not in confirmed_ingredients:
+                confirmed_ingredients.append(ingredient)
     
     return confirmed_ingredients
 
-def get_recommendations(input_text, num_recommendations=5):
-    """Get recipe recommendations based on natural language input"""
-    model = load_model()
-    if not model:
-        return [], []
+def score_recipes(model, query_vectors, use_index=True):
+    """Cosine similarity between query rows and recipes, reading only the query terms' posting lists"""
+    if use_index:
+        return (query_vectors @ model['postings']).tocsr()
+    return (model['tfidf_matrix'] @ query_vectors.T).T.tocsr()
+
+def top_k_scores(indices, scores, k, threshold=SIMILARITY_THRESHOLD):
+    """Select the k best (index, score) pairs above threshold, best first"""
+    import numpy as np
+    
+    keep = scores > threshold
+    indices, scores = indices[keep], scores[keep]
+    if k <= 0:
+        return indices[:0], scores[:0]
     
-    vectorizer = model['vectorizer']
-    tfidf_matrix = model['tfidf_matrix']
-    recipes_df = model['recipes']
+    # Partial selection first so only k candidates get sorted
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        indices, scores = indices[top], scores[top]
     
-    # Extract ingredients from input text
-    ingredients_list = extract_ingredients_from_text(input_text)
+    order = np.argsort(-scores, kind='stable')
+    return indices[order], scores[order]
+
+@functools.lru_cache(maxsize=1)
+def _popcount_table():
+    """Number of set bits in every byte value"""
+    import numpy as np
+    
+    return np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+def _popcount_bytes(values):
+    """Replace every byte in a uint8 array with its number of set bits, in place"""
+    import numpy as np
+    
+    # numpy 2 has a native popcount; older versions go through the table
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values, out=values)
+    return np.take(_popcount_table(), values, out=values, mode='clip')
+
+def coverage_scores(model, ingredients_list):
+    """Share of each recipe's ingredients found in ingredients_list; returns (indices, coverage, matched)"""
+    import numpy as np
+    
+    columns = model['ingredient_columns']
+    found = [columns[ingredient] for ingredient in set(ingredients_list) if ingredient in columns]
+    masks = {}
+    for column in found:
+        masks[column >> 3] = masks.get(column >> 3, 0) | (0x80 >> (column & 7))
+    
+    bits = model['ingredient_bits']
+    # A recipe matches at most len(found) ingredients, so a byte counter
+    # is enough for any realistic pantry
+    matched = np.zeros(bits.shape[1], dtype=np.uint8 if len(found) < 256 else np.int32)
+    buffer = np.empty(bits.shape[1], dtype=np.uint8)
+    for byte, mask in masks.items():
+        np.bitwise_and(bits[byte], mask, out=buffer)
+        if mask & (mask - 1):
+            _popcount_bytes(buffer)
+        else:
+            # A single bit only needs shifting down to 0 or 1
+            np.right_shift(buffer, mask.bit_length() - 1, out=buffer)
+        matched += buffer
+    
+    indices = np.flatnonzero(matched != 0)
+    matched = matched[indices].astype(np.int32)
+    return indices, matched / model['ingredient_counts'][indices], matched
+
+def top_k_coverage(indices, coverage, matched, k):
+    """Select the k best recipes by coverage, then ingredients matched, then recipe order"""
+    import numpy as np
+    
+    if k <= 0:
+        return indices[:0], coverage[:0]
+    
+    # Keep only candidates that can reach the top k before sorting
+    if len(coverage) > k:
+        kth = np.partition(coverage, len(coverage) - k)[len(coverage) - k]
+        keep = coverage >= kth
+        indices, coverage, matched = indices[keep], coverage[keep], matched[keep]
+    
+    order = np.lexsort((indices, -matched, -coverage))[:k]
+    return indices[order], coverage[order]
+
+def rank_recipes(model, query_vectors, ingredients_list, num_recommendations, mode):
+    """Rank recipes for one query in the given mode, returning (indices, scores)"""
+    if mode == 'coverage':
+        return top_k_coverage(*coverage_scores(model, ingredients_list), num_recommendations)
+    
+    # Score only the recipes sharing a term with the input
+    scores = score_recipes(model, query_vectors)
+    return top_k_scores(scores.indices, scores.data, num_recommendations)
+
+def build_query_text(input_text, model):
+    """Return the text to vectorize for a query and the ingredients found in it"""
+    # Extract ingredients from input text using the same model snapshot
+    ingredients_list = extract_ingredients_from_text(input_text, model)
     
     # If no ingredients were extracted, try processing the raw input
     if not ingredients_list:
-        # Preprocess the input text directly
-        preprocessed_input = preprocess_text(input_text)
-        
-        # Transform the preprocessed input to TF-IDF vector
-        input_vector = vectorizer.transform([preprocessed_input])
-    else:
-        # Convert extracted ingredients to a string
-        ingredients_text = ' '.join([preprocess_text(ing) for ing in ingredients_list])
-        
-        # Transform the input ingredients to TF-IDF vector
-        input_vector = vectorizer.transform([ingredients_text])
+        return preprocess_text(input_text), ingredients_list
     
-    # Calculate cosine similarity between input and all recipes
-    cosine_similarities = cosine_similarity(input_vector, tfidf_matrix).flatten()
+    # Convert extracted ingredients to a string, in a fixed order so the same
+    # pantry always produces the same vector
+    ingredient_terms = model['ingredient_matcher']['terms']
+    return ' '.join([ingredient_terms[ing] for ing in sorted(set(ingredients_list))]), ingredients_list
+
+def format_recommendations(model, indices, scores, ingredients_list, mode='tfidf'):
+    """Turn ranked recipe indices into recommendation dicts; coverage mode also lists missing ingredients"""
+    return list(iter_recommendations(model, indices, scores, ingredients_list, mode))
+
+def iter_recommendations(model, indices, scores, ingredients_list, mode='tfidf'):
+    """Yield recommendation dicts one at a time, decoding each recipe on demand"""
+    recipes = model['recipes']
+    pantry = set(ingredients_list)
     
-    # Get top recommendations
-    recommended_indices = cosine_similarities.argsort()[-num_recommendations:][::-1]
+    for idx, similarity_score in zip(indices, scores):
+        recipe = recipes[idx]
+        recommendation = {
+            'recipe_index': int(idx),
+            'name': recipe['name'],
+            'ingredients': recipe['ingredients'],
+            'instructions': recipe['instructions'],
+            'similarity_score': float(similarity_score),
+            'extracted_ingredients': ingredients_list
+        }
+        if mode == 'coverage':
+            recommendation['missing_ingredients'] = [
+                ingredient for ingredient in recipe['ingredients'] if ingredient not in pantry
+            ]
+        yield recommendation
+
+def _rank_query(model, query_text, ingredients_list, num_recommendations, mode, cache_key):
+    """Rank recipes for one query and cache the result; runs on the scoring pool"""
+    try:
+        # Transform the query to a TF-IDF vector
+        input_vector = model['vectorizer'].transform([query_text]) if mode == 'tfidf' else None
+        ranked = rank_recipes(model, input_vector, ingredients_list, num_recommendations, mode)
+        _recommendation_cache_put(cache_key, ranked)
+        return ranked
+    finally:
+        with _scoring_lock:
+            _scoring_in_flight.pop(cache_key, None)
+
+def _get_scoring_pool():
+    """The process's scoring thread pool, started on first use"""
+    global _scoring_pool
+    with _scoring_lock:
+        if _scoring_pool is None:
+            _scoring_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=SCORING_WORKERS, thread_name_prefix='recipe-scoring'
+            )
+        return _scoring_pool
+
+def _rank_single_flight(model, query_text, ingredients_list, num_recommendations, mode, cache_key):
+    """Rank on the scoring pool, sharing one computation between identical queries
     
-    # Get recommended recipes
-    recommendations = []
-    for idx in recommended_indices:
-        recipe = recipes_df.iloc[idx]
-        
-        # Only include recipes with a similarity score above threshold
-        similarity_score = float(cosine_similarities[idx])
-        if similarity_score > 0.05:  # Threshold to ensure some relevance
-            recommendations.append({
-                'name': recipe['name'],
-                'ingredients': recipe['ingredients'],
-                'instructions': recipe['instructions'],
-                'similarity_score': similarity_score,
-                'extracted_ingredients': ingredients_list
-            })
+    Raises ScoringQueueFull when the queue is full and TimeoutError after SCORING_TIMEOUT.
+    """
+    pool = _get_scoring_pool()
+    with _scoring_lock:
+        future = _scoring_in_flight.get(cache_key)
+        if future is not None:
+            _scoring_stats['coalesced'] += 1
+        elif len(_scoring_in_flight) >= SCORING_QUEUE_LIMIT:
+            _scoring_stats['rejected'] += 1
+            raise ScoringQueueFull(f"{SCORING_QUEUE_LIMIT} recommendation requests are already pending")
+        else:
+            _scoring_stats['submitted'] += 1
+            future = pool.submit(_rank_query, model, query_text, ingredients_list, num_recommendations, mode, cache_key)
+            _scoring_in_flight[cache_key] = future
+    
+    try:
+        return future.result(timeout=SCORING_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        with _scoring_lock:
+            _scoring_stats['timeouts'] += 1
+        raise
+
+def get_scoring_stats():
+    """Counters of the scoring pool, for monitoring"""
+    with _scoring_lock:
+        return dict(
+            _scoring_stats,
+            pending=len(_scoring_in_flight),
+            workers=SCORING_WORKERS,
+            queue_limit=SCORING_QUEUE_LIMIT,
+            timeout_seconds=SCORING_TIMEOUT
+        )
+
+def rank_query(model, input_text, num_recommendations=5, mode='tfidf'):
+    """Rank recipes for natural language input against one model snapshot; returns ((indices, scores), ingredients)"""
+    query_text, ingredients_list = build_query_text(input_text, model)
+    cache_key = _recommendation_cache_key(model, query_text, ingredients_list, num_recommendations, mode)
+    ranked = _recommendation_cache_get(cache_key)
+    
+    if ranked is None:
+        ranked = _rank_single_flight(model, query_text, ingredients_list, num_recommendations, mode, cache_key)
+    return ranked, ingredients_list
+
+def get_recommendations(input_text, num_recommendations=5, mode='tfidf'):
+    """Get recipe recommendations based on natural language input"""
+    model = load_model()
+    if not model:
+        return [], []
     
+    ranked, ingredients_list = rank_query(model, input_text, num_recommendations, mode)
+    recommendations = format_recommendations(model, *ranked, ingredients_list, mode)
     return recommendations, ingredients_list
 
-def get_all_ingredients():
-    """Get a list of all available ingredients"""
+def get_batch_recommendations(input_texts, num_recommendations=5, mode='tfidf'):
+    """Get recommendations for many queries, vectorized and scored together in tfidf mode"""
     model = load_model()
+    if not model or not input_texts:
+        return [([], []) for _ in input_texts]
+    
+    query_texts = []
+    extracted = []
+    cache_keys = []
+    ranked = []
+    for input_text in input_texts:
+        query_text, ingredients_list = build_query_text(input_text, model)
+        cache_key = _recommendation_cache_key(model, query_text, ingredients_list, num_recommendations, mode)
+        query_texts.append(query_text)
+        extracted.append(ingredients_list)
+        cache_keys.append(cache_key)
+        ranked.append(_recommendation_cache_get(cache_key))
+    
+    # Score every cache miss in one go
+    pending = [i for i, result in enumerate(ranked) if result is None]
+    if pending and mode == 'coverage':
+        for i in pending:
+            ranked[i] = rank_recipes(model, None, extracted[i], num_recommendations, mode)
+            _recommendation_cache_put(cache_keys[i], ranked[i])
+    elif pending:
+        scores = score_recipes(model, model['vectorizer'].transform([query_texts[i] for i in pending]))
+        for row, i in enumerate(pending):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            ranked[i] = top_k_scores(scores.indices[start:end], scores.data[start:end], num_recommendations)
+            _recommendation_cache_put(cache_keys[i], ranked[i])
+    
+    return [
+        (format_recommendations(model, *result, ingredients_list, mode), ingredients_list)
+        for result, ingredients_list in zip(ranked, extracted)
+    ]
+
+def get_all_ingredients(model=None):
+    """Get a list of all available ingredients"""
+    if model is None:
+        model = load_model()
     if not model:
         return []
     
-    recipes_df = model['recipes']
+    return model['all_ingredients']
+
+def suggest_ingredients(prefix, limit=DEFAULT_SUGGESTIONS, model=None):
+    """Complete a typed prefix to known ingredients as {'ingredient', 'recipes'} dicts, most used first"""
+    if model is None:
+        model = load_model()
+    if not model:
+        return []
+    
+    suggester = model['ingredient_suggester']
+    frequencies = suggester['frequencies']
+    prefix = ' '.join(prefix.lower().split())
     
-    # Extract unique ingredients from all recipes
-    all_ingredients = set()
-    for ingredients in recipes_df['ingredients']:
-        all_ingredients.update(ingredients)
+    if not prefix:
+        columns = suggester['popular'][:limit]
+    else:
+        keys = suggester['keys']
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        candidates = set(suggester['columns'][start:end])
+        columns = heapq.nsmallest(limit, candidates, key=lambda column: (-frequencies[column], column))
     
-    return sorted(list(all_ingredients))
+    return [
+        {'ingredient': model['all_ingredients'][column], 'recipes': frequencies[column]}
+        for column in columns
+    ]
+
+def _query_fingerprint(input_text, mode, limit):
+    """Short digest tying a pagination cursor to the query it was issued for"""
+    canonical = json.dumps([' '.join(input_text.lower().split()), mode, limit])
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+def encode_cursor(model, fingerprint, offset):
+    """Opaque cursor for the page of results starting at offset"""
+    payload = json.dumps({'model': model.get('artifact_version'), 'query': fingerprint, 'offset': offset})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the cursor's fields, or None if it is malformed"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        fields = json.loads(payload)
+        if not isinstance(fields['offset'], int) or fields['offset'] < 0:
+            return None
+        return fields
+    except (TypeError, ValueError, KeyError):
+        return None
+
+def _stream_error(message, status):
+    """Error response of the streaming mode, shaped like other /ai errors"""
+    return jsonify({'error': message, 'recommendations': [], 'extracted_ingredients': []}), status
+
+def stream_recommendations(data):
+    """Streaming mode of /ai: one page of results as newline-delimited JSON
+    
+    Ranking finishes before the response starts, so its errors still get a status code.
+    """
+    user_input = data.get('query', '')
+    mode = data.get('mode', 'tfidf')
+    limit = data.get('limit', MAX_STREAM_RECOMMENDATIONS)
+    page_size = data.get('page_size', STREAM_PAGE_SIZE)
+    cursor = data.get('cursor')
+    
+    if not isinstance(user_input, str):
+        return _stream_error('query must be a string', 400)
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_STREAM_RECOMMENDATIONS:
+        return _stream_error(f'limit must be between 1 and {MAX_STREAM_RECOMMENDATIONS}', 400)
+    if not isinstance(page_size, int) or not 1 <= page_size <= limit:
+        return _stream_error('page_size must be between 1 and limit', 400)
+    
+    model = load_model()
+    if not model:
+        return _stream_error('Recipe model is not available', 503)
+    
+    fingerprint = _query_fingerprint(user_input, mode, limit)
+    offset = 0
+    if cursor is not None:
+        fields = decode_cursor(cursor) if isinstance(cursor, str) else None
+        if fields is None or fields.get('query') != fingerprint:
+            return _stream_error('cursor is invalid or belongs to a different query', 400)
+        if fields.get('model') != model.get('artifact_version'):
+            return _stream_error('The recipe model changed since this cursor was issued. Start again without a cursor.', 410)
+        offset = fields['offset']
+    
+    (indices, scores), ingredients_list = rank_query(model, user_input, limit, mode)
+    page_end = offset + page_size
+    next_cursor = encode_cursor(model, fingerprint, page_end) if page_end < len(indices) else None
+    
+    def generate():
+        yield json.dumps({
+            'type': 'meta',
+            'mode': mode,
+            'extracted_ingredients': ingredients_list,
+            'total': len(indices),
+            'offset': offset
+        }) + '\n'
+        page = iter_recommendations(model, indices[offset:page_end], scores[offset:page_end], ingredients_list, mode)
+        for rank, recommendation in enumerate(page, offset + 1):
+            yield json.dumps(dict(recommendation, type='recommendation', rank=rank)) + '\n'
+        yield json.dumps({'type': 'end', 'next_cursor': next_cursor}) + '\n'
+    
+    # Ask reverse proxies not to buffer the stream
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+def wants_stream(data):
+    """Whether a JSON /ai request asked for the NDJSON streaming mode"""
+    if data.get('stream'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
 
 def handle_ai_request():
     """Handle AI recommendation requests"""
@@ -254,9 +1791,10 @@ def handle_ai_request():
     user_input = ""
     extracted_ingredients = []
     error_message = None
+    status = 200
     
     # Check if model data exists
-    if not os.path.exists(DATA_PATH):
+    if not os.path.exists(get_data_path()):
         error_message = "Recipe data not found. Please ensure model.json exists in the logic directory."
     
     if request.method == 'POST':
@@ -264,6 +1802,14 @@ def handle_ai_request():
             # Handle AJAX request for recommendations
             data = request.get_json()
             user_input = data.get('query', '')
+            mode = data.get('mode', 'tfidf')
+            
+            if mode not in RANKING_MODES:
+                return jsonify({
+                    'error': f"mode must be one of: {', '.join(RANKING_MODES)}",
+                    'recommendations': [],
+                    'extracted_ingredients': []
+                }), 400
             
             if error_message:
                 return jsonify({
@@ -272,10 +1818,26 @@ def handle_ai_request():
                     'extracted_ingredients': []
                 })
             
-            recommendations, extracted_ingredients = get_recommendations(user_input)
+            try:
+                if wants_stream(data):
+                    return stream_recommendations(data)
+                recommendations, extracted_ingredients = get_recommendations(user_input, mode=mode)
+            except ScoringQueueFull:
+                return jsonify({
+                    'error': 'Too many recommendation requests right now. Please try again shortly.',
+                    'recommendations': [],
+                    'extracted_ingredients': []
+                }), 503, {'Retry-After': '1'}
+            except concurrent.futures.TimeoutError:
+                return jsonify({
+                    'error': 'Finding recommendations took too long. Please try again.',
+                    'recommendations': [],
+                    'extracted_ingredients': []
+                }), 504
             
             # Format response for JSON
             response = {
+                'mode': mode,
                 'recommendations': recommendations,
                 'extracted_ingredients': extracted_ingredients
             }
@@ -283,8 +1845,18 @@ def handle_ai_request():
         else:
             # Handle form submission
             user_input = request.form.get('query', '')
+            mode = request.form.get('mode', 'tfidf')
+            if mode not in RANKING_MODES:
+                mode = 'tfidf'
             if user_input and not error_message:
-                recommendations, extracted_ingredients = get_recommendations(user_input)
+                try:
+                    recommendations, extracted_ingredients = get_recommendations(user_input, mode=mode)
+                except ScoringQueueFull:
+                    error_message = "Too many recommendation requests right now. Please try again shortly."
+                    status = 503
+                except concurrent.futures.TimeoutError:
+                    error_message = "Finding recommendations took too long. Please try again."
+                    status = 504
     
     # For both GET requests and form submissions
     return render_template('ai.html', 
@@ -293,9 +1865,177 @@ def handle_ai_request():
                           recommendations=recommendations, 
                           user_input=user_input,
                           extracted_ingredients=extracted_ingredients,
-                          all_ingredients=get_all_ingredients(),
-                          error_message=error_message)
+                          popular_ingredients=[
+                              suggestion['ingredient']
+                              for suggestion in suggest_ingredients('', POPULAR_INGREDIENTS_SHOWN)
+                          ],
+                          error_message=error_message), status
+
+def handle_ai_batch_request():
+    """Handle batch recommendation requests from the meal-planning backend"""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    num_recommendations = data.get('num_recommendations', 5)
+    mode = data.get('mode', 'tfidf')
+    
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return jsonify({'error': 'queries must be a list of strings', 'results': []}), 400
+    
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per batch', 'results': []}), 400
+    
+    if not isinstance(num_recommendations, int) or not 1 <= num_recommendations <= MAX_RECOMMENDATIONS:
+        return jsonify({'error': f'num_recommendations must be between 1 and {MAX_RECOMMENDATIONS}', 'results': []}), 400
+    
+    if mode not in RANKING_MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(RANKING_MODES)}", 'results': []}), 400
+    
+    if not os.path.exists(get_data_path()):
+        return jsonify({
+            'error': "Recipe data not found. Please ensure model.json exists in the logic directory.",
+            'results': []
+        })
+    
+    results = get_batch_recommendations(queries, num_recommendations, mode)
+    
+    return jsonify({
+        'mode': mode,
+        'results': [
+            {
+                'query': query,
+                'recommendations': recommendations,
+                'extracted_ingredients': extracted_ingredients
+            }
+            for query, (recommendations, extracted_ingredients) in zip(queries, results)
+        ]
+    })
+
+def api_get_ai_stats():
+    """API endpoint exposing model and cache counters for monitoring"""
+    return jsonify({
+        'model_version': _model_state['version'],
+        'artifact_version': (_model_state['model'] or {}).get('artifact_version'),
+        'model_loaded': _model_state['model'] is not None,
+        'recommendation_cache': get_recommendation_cache_stats(),
+        'scoring': get_scoring_stats()
+    })
+
+def api_suggest_ingredients():
+    """API endpoint for ingredient autocomplete"""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', DEFAULT_SUGGESTIONS, type=int)
+    
+    if not 1 <= limit <= MAX_SUGGESTIONS:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SUGGESTIONS}', 'suggestions': []}), 400
+    
+    return jsonify({
+        'query': query,
+        'suggestions': suggest_ingredients(query, limit)
+    })
+
+def get_similar_recipes(recipe_index, limit=NEIGHBOR_COUNT, model=None):
+    """Recipes most similar to one recipe, from the table if the model has one, else scored on request"""
+    if model is None:
+        model = load_model()
+    if not model:
+        return None
+    
+    if 'neighbors' in model:
+        indices = model['neighbors'][recipe_index, :limit]
+        scores = model['neighbor_scores'][recipe_index, :limit]
+        indices, scores = indices[indices >= 0], scores[indices >= 0]
+    else:
+        scored = score_recipes(model, model['tfidf_matrix'][recipe_index])
+        # A recipe is not its own neighbor
+        others = scored.indices != recipe_index
+        indices, scores = top_k_scores(scored.indices[others], scored.data[others], limit, threshold=0)
+    
+    recipes = model['recipes']
+    similar = []
+    for idx, score in zip(indices, scores):
+        recipe = recipes[idx]
+        similar.append({
+            'recipe_index': int(idx),
+            'name': recipe['name'],
+            'ingredients': recipe['ingredients'],
+            'similarity_score': float(score)
+        })
+    return similar
+
+def api_get_similar_recipes(recipe_index):
+    """API endpoint for "more like this" on one recipe"""
+    limit = request.args.get('limit', NEIGHBOR_COUNT, type=int)
+    if not 1 <= limit <= NEIGHBOR_COUNT:
+        return jsonify({'error': f'limit must be between 1 and {NEIGHBOR_COUNT}', 'similar': []}), 400
+    
+    model = load_model()
+    if not model or not 0 <= recipe_index < len(model['recipes']):
+        return jsonify({'error': 'Recipe not found', 'similar': []}), 404
+    
+    similar = get_similar_recipes(recipe_index, limit, model)
+    return jsonify({
+        'recipe_index': recipe_index,
+        'name': model['recipes'][recipe_index]['name'],
+        'similar': similar
+    })
+
+def is_recipe_editor():
+    """Whether the current request may add recipes: an editor account or the editor token"""
+    token = request.headers.get('X-Editor-Token', '')
+    if EDITOR_TOKEN and token and hmac.compare_digest(token.encode('utf-8'), EDITOR_TOKEN.encode('utf-8')):
+        return True
+    
+    current_user = get_current_user()
+    return bool(current_user) and (
+        current_user.get('auth_type') == 'traditional'
+        and current_user.get('username') in EDITOR_USERNAMES
+    )
+
+def api_add_recipes():
+    """API endpoint for editors to add recipes without a full retrain"""
+    if not is_recipe_editor():
+        if not get_current_user() and not request.headers.get('X-Editor-Token'):
+            return jsonify({'success': False, 'message': 'Authentication required'}), 401
+        return jsonify({'success': False, 'message': 'Only recipe editors can add recipes'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    recipes = data.get('recipes')
+    if not isinstance(recipes, list) or not recipes:
+        return jsonify({'success': False, 'message': 'recipes must be a non-empty list'}), 400
+    
+    success, message, refit_scheduled = add_recipes(recipes)
+    if not success:
+        return jsonify({'success': False, 'message': message}), 400
+    
+    model = load_model()
+    return jsonify({
+        'success': True,
+        'message': message,
+        'total_recipes': len(model['recipes']),
+        'refit_scheduled': refit_scheduled
+    })
 
 # When this script is run directly, train the model
 if __name__ == "__main__":
-    train_model()
\ No newline at end of file
+    # `python ai.py` from inside logic/ still needs the logic package importable
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    # `python ai.py neighbors` computes the similar-recipes table instead;
+    # `versions`, `rollback` and `activate <version>` manage saved models
+    command = sys.argv[1:]
+    if command == ['neighbors']:
+        build_neighbor_table()
+    elif command == ['versions']:
+        for entry in list_model_versions():
+            print(('* ' if entry['active'] else '  ') + entry['version'])
+    elif command == ['rollback']:
+        version = rollback_model()
+        print(f"Rolled back to {version}." if version else "No previous model version to roll back to.")
+    elif len(command) == 2 and command[0] == 'activate':
+        activate_model_version(command[1])
+        print(f"Activated {command[1]}.")
+    else:
+        from logic import model_store
+        with model_store.training_lock(MODEL_DIR):
+            train_model()
\ No newline at end of file
@@ -0,0 +1,805 @@
+"""Benchmarks for the recipe AI path
+
+Run from the project root, for example:
+
+    python -m logic.benchmark preprocess
+    python -m logic.benchmark parse --queries queries.txt
+    python -m logic.benchmark catalog --sizes 1000 10000 --compare last-release.json
+
+Results are also written to --output (benchmark-results.json by default).
+Exits with a non-zero status when a check fails (see bench_import,
+bench_parse, bench_user_reads, bench_web3_logins, bench_login_scaling and
+bench_analytics).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from logic import ai
+
+def legacy_preprocess_text(text):
+    """The original preprocess_text, kept as the benchmark baseline"""
+    text = text.lower()
+    text = ''.join([char for char in text if char not in string.punctuation])
+    tokens = text.split()
+    lemmatizer, stop_words = ai.get_nlp_resources()
+    tokens = [lemmatizer.lemmatize(token) for token in tokens if token not in stop_words]
+    return ' '.join(tokens)
+
+def load_sample_texts():
+    """Strings shaped like real traffic: ingredient names, recipe names and instructions"""
+    texts = []
+    for chunk in ai.iter_recipe_chunks(ai.get_data_path()):
+        for recipe in chunk:
+            texts.append(recipe['name'])
+            texts.extend(recipe['ingredients'])
+            texts.append(recipe['instructions'])
+    return texts
+
+def _best_of(func, repeat, number):
+    """Best per-call time in microseconds"""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1e6
+
+def bench_preprocess(repeat=5, number=20):
+    """Compare the legacy preprocess_text with the memoized pipeline"""
+    texts = load_sample_texts() * 10
+
+    # Both versions must agree before timing means anything
+    expected = [legacy_preprocess_text(text) for text in texts]
+    if ai.preprocess_texts(texts) != expected:
+        raise AssertionError("preprocess_texts output differs from the legacy implementation")
+
+    results = {
+        'texts': len(texts),
+        'legacy_us': _best_of(lambda: [legacy_preprocess_text(text) for text in texts], repeat, number),
+        'preprocess_text_us': _best_of(lambda: [ai.preprocess_text(text) for text in texts], repeat, number),
+        'preprocess_texts_us': _best_of(lambda: ai.preprocess_texts(texts), repeat, number)
+    }
+    results['speedup'] = results['legacy_us'] / results['preprocess_text_us']
+    results['batch_speedup'] = results['legacy_us'] / results['preprocess_texts_us']
+    return results
+
+# Wall-clock budget for importing the app with warm-up disabled
+IMPORT_TIME_BUDGET = float(os.environ.get('RECIPE_IMPORT_TIME_BUDGET', '1.0'))
+
+# Modules that must stay out of the import path of the app
+DEFERRED_MODULES = ['numpy', 'scipy', 'sklearn', 'nltk', 'joblib']
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+def bench_import(repeat=3):
+    """Time `import app` in fresh interpreters and check heavy modules stay deferred"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, RECIPE_AI_WARMUP='0')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _IMPORT_PROBE % DEFERRED_MODULES],
+            cwd=project_root, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    
+    seconds = min(run['seconds'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    return {
+        'import_s': seconds,
+        'budget_s': IMPORT_TIME_BUDGET,
+        'eagerly_loaded': loaded,
+        'passed': seconds <= IMPORT_TIME_BUDGET and not loaded
+    }
+
+# Catalog sizes generated by the catalog benchmark
+CATALOG_SIZES = [1000, 10000, 100000, 1000000]
+
+# Words used to build synthetic recipes on top of the real ingredient list
+_MODIFIERS = ['segar', 'cincang', 'iris', 'bubuk', 'kering', 'rebus', 'goreng', 'halus', 'muda', 'tua']
+_TECHNIQUES = ['Tumis', 'Sup', 'Gulai', 'Sambal', 'Pepes', 'Bakar', 'Goreng', 'Rebus', 'Kari', 'Soto']
+_REGIONS = ['Padang', 'Betawi', 'Jawa', 'Bali', 'Medan', 'Manado', 'Aceh', 'Sunda', 'Makassar', 'Lombok']
+_QUERY_TEMPLATES = [
+    'saya punya {}',
+    'resep dengan {}',
+    'I have {}',
+    '{}'
+]
+
+def synthetic_ingredients():
+    """Ingredient vocabulary: the real catalog's ingredients plus modified variants"""
+    base = sorted({
+        ingredient
+        for chunk in ai.iter_recipe_chunks(ai.get_data_path())
+        for recipe in chunk
+        for ingredient in recipe['ingredients']
+    })
+    return base + [f'{ingredient} {modifier}' for modifier in _MODIFIERS for ingredient in base]
+
+def _zipf_weights(n):
+    """Cumulative weights so a few staples appear in most recipes, like real catalogs"""
+    weights = []
+    total = 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank
+        weights.append(total)
+    return weights
+
+def generate_catalog(path, n_recipes, ingredients, seed=0):
+    """Write n_recipes recipes shaped like model.json as JSON Lines"""
+    rng = random.Random(seed)
+    weights = _zipf_weights(len(ingredients))
+    with open(path, 'w', encoding='utf-8') as file:
+        for _ in range(n_recipes):
+            recipe_ingredients = list(dict.fromkeys(
+                rng.choices(ingredients, cum_weights=weights, k=rng.randint(4, 12))
+            ))
+            technique = rng.choice(_TECHNIQUES)
+            main = recipe_ingredients[-1]
+            file.write(json.dumps({
+                'name': f'{technique} {main.title()} {rng.choice(_REGIONS)}',
+                'ingredients': recipe_ingredients,
+                'instructions': (
+                    f"1. Siapkan {', '.join(recipe_ingredients[:-1])}. "
+                    f"2. {technique} {main} hingga matang. 3. Sajikan selagi hangat."
+                )
+            }, ensure_ascii=False) + '\n')
+
+def generate_queries(n_queries, ingredients, seed=0):
+    """User queries naming two to five ingredients"""
+    rng = random.Random(seed)
+    weights = _zipf_weights(len(ingredients))
+    queries = []
+    for _ in range(n_queries):
+        picked = list(dict.fromkeys(rng.choices(ingredients, cum_weights=weights, k=rng.randint(2, 5))))
+        listed = ', '.join(picked[:-1]) + ' dan ' + picked[-1] if len(picked) > 1 else picked[0]
+        queries.append(rng.choice(_QUERY_TEMPLATES).format(listed))
+    return queries
+
+def _latency_summary(samples):
+    """p50/p95/p99 of per-call times in milliseconds"""
+    import numpy as np
+    
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1e3, [50, 95, 99])
+    return {'samples': len(samples), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+def _measure(func, calls, before=None):
+    """Time func(*args) for each args in calls, then trace the peak memory of one more call
+    
+    Timing and memory use separate calls because tracemalloc slows Python
+    code down. peak_memory_mb covers allocations made by this process;
+    training worker processes and memory-mapped model files are not counted.
+    """
+    samples = []
+    for args in calls:
+        if before:
+            before()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        func(*calls[0])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    results = _latency_summary(samples)
+    results['peak_memory_mb'] = peak / 2 ** 20
+    return results
+
+def _unload_model():
+    """Drop the loaded model and cached results so the next load_model reads from disk"""
+    with ai._model_lock:
+        ai._model_state['model'] = None
+        ai._model_state['signature'] = None
+    ai.clear_recommendation_cache()
+
+def _use_catalog_dir(directory):
+    """Point the ai module's model and data paths into directory"""
+    ai.MODEL_DIR = os.path.join(directory, 'models')
+    ai.MODEL_PATH = os.path.join(directory, 'model.joblib')
+    ai.DATA_PATH = os.path.join(directory, 'model.json')
+    ai.DATA_JSONL_PATH = os.path.join(directory, 'model.jsonl')
+
+def bench_catalog_size(directory, n_recipes, ingredients, n_queries=200, train_repeat=1, load_repeat=5):
+    """Generate one catalog and time each stage of the recommendation path on it"""
+    _use_catalog_dir(directory)
+    generate_catalog(ai.DATA_JSONL_PATH, n_recipes, ingredients)
+    queries = [(query,) for query in generate_queries(n_queries, ingredients)]
+    
+    results = {
+        'recipes': n_recipes,
+        'catalog_mb': os.path.getsize(ai.DATA_JSONL_PATH) / 2 ** 20
+    }
+    
+    # Each training run starts with an empty lemma cache, like a fresh process
+    results['train_model'] = _measure(ai.train_model, [()] * train_repeat, before=ai._lemmatize.cache_clear)
+    results['load_model'] = _measure(ai.load_model, [()] * load_repeat, before=_unload_model)
+    
+    model = ai.load_model()
+    results['extract_ingredients_from_text'] = _measure(
+        lambda query: ai.extract_ingredients_from_text(query, model), queries
+    )
+    
+    # Result caching is bypassed so every call does the full ranking
+    for mode in ai.RANKING_MODES:
+        results[f'get_recommendations[{mode}]'] = _measure(
+            lambda query: ai.get_recommendations(query, mode=mode), queries, before=ai.clear_recommendation_cache
+        )
+    
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    _unload_model()
+    return results
+
+def bench_catalog(sizes=CATALOG_SIZES):
+    """Time training, loading, extraction and ranking on synthetic catalogs of each size"""
+    ingredients = synthetic_ingredients()
+    paths = (ai.MODEL_DIR, ai.MODEL_PATH, ai.DATA_PATH, ai.DATA_JSONL_PATH)
+    ai.get_nlp_resources()
+    
+    results = {'ingredients': len(ingredients), 'train_workers': ai.TRAIN_WORKERS, 'sizes': {}}
+    try:
+        for n_recipes in sizes:
+            with tempfile.TemporaryDirectory(prefix='recipe-bench-') as directory:
+                results['sizes'][str(n_recipes)] = bench_catalog_size(directory, n_recipes, ingredients)
+                print(f"catalog: {n_recipes} recipes done", file=sys.stderr)
+    finally:
+        ai.MODEL_DIR, ai.MODEL_PATH, ai.DATA_PATH, ai.DATA_JSONL_PATH = paths
+    return results
+
+def compare_catalog_results(baseline, current):
+    """Print the p50/p95 change of every stage measured in both runs"""
+    baseline_sizes = baseline.get('catalog', {}).get('sizes', {})
+    for size, stages in current.get('catalog', {}).get('sizes', {}).items():
+        for stage, stats in stages.items():
+            before = baseline_sizes.get(size, {}).get(stage)
+            if not isinstance(stats, dict) or not isinstance(before, dict):
+                continue
+            changes = ', '.join(
+                f"{key} {before[key]:.2f} -> {stats[key]:.2f} ms ({(stats[key] / before[key] - 1) * 100:+.0f}%)"
+                for key in ('p50_ms', 'p95_ms') if before.get(key)
+            )
+            print(f"{size:>8} {stage}: {changes}")
+
+def run_metadata():
+    """Environment details stored next to the results so runs can be compared"""
+    import numpy
+    import scipy
+    import sklearn
+    
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'scipy': scipy.__version__,
+        'scikit-learn': sklearn.__version__
+    }
+
+def _misspell(word, rng):
+    """One random typo: a swapped, dropped, doubled or replaced letter"""
+    i = rng.randrange(len(word) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == 1:
+        return word[:i] + word[i + 1:]
+    if kind == 2:
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+def bench_typo(vocabulary_sizes=(1000, 10000, 50000), n_lookups=2000, seed=0):
+    """Latency of typo correction as the ingredient vocabulary grows"""
+    rng = random.Random(seed)
+    results = {'max_edit_distance': ai.TYPO_MAX_EDIT_DISTANCE, 'sizes': {}}
+    for size in vocabulary_sizes:
+        words = set()
+        while len(words) < size:
+            words.add(''.join(rng.choice('aiueo' if i % 2 else 'bcdgjklmnprstw') for i in range(rng.randint(4, 9))))
+        words = sorted(words)
+        
+        start = time.perf_counter()
+        typo_index = ai.build_typo_index(words, [1] * len(words))
+        build_seconds = time.perf_counter() - start
+        
+        lookups = [_misspell(rng.choice(words), rng) for _ in range(n_lookups)]
+        samples = []
+        for word in lookups:
+            start = time.perf_counter()
+            ai.correct_word(typo_index, word)
+            samples.append(time.perf_counter() - start)
+        
+        results['sizes'][str(size)] = dict(
+            _latency_summary(samples),
+            build_s=build_seconds,
+            index_keys=len(typo_index['deletes'])
+        )
+    return results
+
+def legacy_parse_user_query(query):
+    """The original parse_user_query, kept as the benchmark baseline"""
+    query = query.lower()
+    ingredient_indicators = ["i have", "we have", "got", "using", "with", "use",
+        "ingredients:", "ingredients are", "ingredients include",
+        "saya punya", "aku punya", "bahan:", "bahan-bahan:"]
+    for indicator in ingredient_indicators:
+        query = query.replace(indicator, "")
+    ingredients = []
+    for item in re.split(r'[,;.]|and|dan', query):
+        item = item.strip()
+        if item and len(item) > 1:
+            ingredients.append(item)
+    return ingredients
+
+# Queries phrased the way people type them into the /ai search box, with
+# the ingredients a correct parse returns
+SAMPLE_QUERIES = {
+    'saya punya telur, nasi dan bawang merah': ['telur', 'nasi', 'bawang merah'],
+    'aku punya ayam, santan, serta daun pandan': ['ayam', 'santan', 'daun pandan'],
+    'bahan: 2 butir telur, 1 siung bawang putih, kecap manis': ['telur', 'bawang putih', 'kecap manis'],
+    'bahan-bahan: tahu; tempe; cabai rawit': ['tahu', 'tempe', 'cabai rawit'],
+    'I have chicken, garlic and some onions': ['chicken', 'garlic', 'onions'],
+    'ingredients are rice, eggs and soy sauce': ['rice', 'eggs', 'soy sauce'],
+    'using 500 gram daging sapi dengan kentang': ['daging sapi', 'kentang'],
+    'nasi, dandang, daun pandan': ['nasi', 'dandang', 'daun pandan'],
+    'ikan atau udang + jeruk nipis': ['ikan', 'udang', 'jeruk nipis'],
+    'kangkung dan terasi secukupnya': ['kangkung', 'terasi'],
+    'we have tomatoes & basil plus 1/2 cup olive oil': ['tomatoes', 'basil', 'olive oil'],
+    'gula merah, kelapa parut dan sedikit garam': ['gula merah', 'kelapa parut', 'garam']
+}
+
+def load_query_corpus(path=None, n_generated=5000):
+    """Queries to parse: a file with one query per line if given, else
+    the sample queries plus generated ones naming real catalog ingredients"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as file:
+            return [line.strip() for line in file if line.strip()]
+    return list(SAMPLE_QUERIES) + generate_queries(n_generated, synthetic_ingredients())
+
+def bench_parse(path=None, repeat=5, number=5):
+    """Throughput of parse_user_query against the legacy replace-and-split parser"""
+    queries = load_query_corpus(path)
+    results = {
+        'queries': len(queries),
+        'legacy_qps': len(queries) / (_best_of(lambda: [legacy_parse_user_query(q) for q in queries], repeat, number) / 1e6),
+        'parse_qps': len(queries) / (_best_of(lambda: [ai.parse_user_query(q) for q in queries], repeat, number) / 1e6)
+    }
+    results['speedup'] = results['parse_qps'] / results['legacy_qps']
+    
+    # Parsing costs microseconds next to the milliseconds of ranking; what
+    # the parser is for is getting the ingredients right
+    results['sample_queries'] = len(SAMPLE_QUERIES)
+    results['legacy_correct'] = sum(legacy_parse_user_query(q) == expected for q, expected in SAMPLE_QUERIES.items())
+    results['parse_correct'] = sum(ai.parse_user_query(q) == expected for q, expected in SAMPLE_QUERIES.items())
+    
+    # A catalog ingredient typed on its own must come back whole; the legacy
+    # parser cuts names such as "daun pandan" at the "dan" inside them
+    ingredients = {
+        ingredient.lower().strip()
+        for chunk in ai.iter_recipe_chunks(ai.get_data_path())
+        for recipe in chunk
+        for ingredient in recipe['ingredients']
+    }
+    results['catalog_ingredients'] = len(ingredients)
+    results['legacy_split_ingredients'] = sum(legacy_parse_user_query(i) != [i] for i in ingredients)
+    results['split_ingredients'] = sum(ai.parse_user_query(i) != [i] for i in ingredients)
+    results['passed'] = results['parse_correct'] == len(SAMPLE_QUERIES) and not results['split_ingredients']
+    return results
+
+# Pages checked by bench_user_reads, and the most user store reads one
+# request may make
+USER_READ_PAGES = ['/home', '/api/user']
+USER_READ_BUDGET = 1
+
+def _use_user_db(path, legacy_path):
+    """Point the user store at another database, dropping this thread's connection"""
+    from logic import user_store
+    
+    # Buffered statistics belong to the database being left
+    user_store.flush_wallet_stats()
+    if hasattr(user_store.thread_local, 'conn'):
+        user_store.thread_local.conn.close()
+        del user_store.thread_local.conn
+    user_store.USER_DB_PATH = path
+    user_store.LEGACY_USERS_PATH = legacy_path
+
+def bench_user_reads():
+    """User store reads per page view, logged out and as each kind of user
+    
+    Pages ask for the current user several times (the template context
+    processor, the handler); it is memoized per request, so a page may read
+    the store at most USER_READ_BUDGET times. Opening a connection, as each
+    new server thread does, must not write once user.json is imported.
+    """
+    import threading
+    
+    from logic import home, user_store
+    os.environ.setdefault('RECIPE_AI_WARMUP', '0')
+    import app as app_module
+    
+    saved_paths = (user_store.USER_DB_PATH, user_store.LEGACY_USERS_PATH)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'user.json')
+        with open(legacy_path, 'w', encoding='utf-8') as file:
+            json.dump(user_store.empty_users_data(), file)
+        _use_user_db(os.path.join(directory, 'users.db'), legacy_path)
+        home.register_user('bench', 'bench@example.com', 'secret')
+        
+        def page_reads(client):
+            reads = {}
+            for page in USER_READ_PAGES:
+                before = user_store.get_stats()['reads']
+                client.get(page)
+                reads[page] = user_store.get_stats()['reads'] - before
+            return reads
+        
+        results = {'budget': USER_READ_BUDGET, 'reads': {}}
+        
+        client = app_module.app.test_client()
+        results['reads']['logged_out'] = page_reads(client)
+        
+        client.post('/login', data={'username': 'bench', 'password': 'secret'})
+        results['reads']['traditional'] = page_reads(client)
+        
+        client = app_module.app.test_client()
+        wallet = {'wallet_address': '0x' + 'ab' * 20, 'wallet_type': 'metamask', 'chain': 'ethereum'}
+        client.post('/web3-auth', json=wallet)
+        client.post('/web3-verify', json=dict(wallet, signature='0x00'))
+        results['reads']['web3'] = page_reads(client)
+        
+        before = user_store.get_stats()['writes']
+        thread = threading.Thread(target=lambda: user_store.find_by_username('bench'))
+        thread.start()
+        thread.join()
+        results['new_connection_writes'] = user_store.get_stats()['writes'] - before
+        
+        _use_user_db(*saved_paths)
+    
+    results['passed'] = results['new_connection_writes'] == 0 and all(
+        reads <= USER_READ_BUDGET
+        for pages in results['reads'].values()
+        for reads in pages.values()
+    )
+    return results
+
+# Wallets logging in at the same time in the Web3 login check
+CONCURRENT_WALLETS = 100
+
+_BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+def bench_web3_logins(n_wallets=CONCURRENT_WALLETS, seed=0):
+    """Concurrent Web3 logins lose no updates
+    
+    Each of n_wallets threads, with its own store connection, logs in its
+    own new wallet and then one wallet they all share, all released at
+    once. Afterwards every account, login count and statistic must add up,
+    and each login must have taken one read and one commit.
+    """
+    import threading
+    from logic import home, user_store
+    os.environ.setdefault('RECIPE_AI_WARMUP', '0')
+    import app as app_module
+    
+    rng = random.Random(seed)
+    wallets = []
+    for i in range(n_wallets):
+        if i % 2:
+            wallets.append((''.join(rng.choice(_BASE58) for _ in range(44)), 'solana', 'phantom'))
+        else:
+            wallets.append(('0x' + ''.join(rng.choice('0123456789abcdef') for _ in range(40)), 'ethereum', 'metamask'))
+    shared = ('0x' + 'cd' * 20, 'ethereum', 'metamask')
+    
+    saved_paths = (user_store.USER_DB_PATH, user_store.LEGACY_USERS_PATH)
+    with tempfile.TemporaryDirectory() as directory:
+        _use_user_db(os.path.join(directory, 'users.db'), os.path.join(directory, 'user.json'))
+        # Create the schema up front so the threads only race on logins
+        user_store.get_db_connection()
+        
+        barrier = threading.Barrier(n_wallets)
+        errors = []
+        
+        def login(wallet):
+            try:
+                barrier.wait()
+                for address, chain, wallet_type in (wallet, shared):
+                    with app_module.app.test_request_context():
+                        success, message = home.login_web3_user(address, chain, wallet_type)
+                    if not success:
+                        errors.append(message)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                if hasattr(user_store.thread_local, 'conn'):
+                    user_store.thread_local.conn.close()
+        
+        threads = [threading.Thread(target=login, args=(wallet,)) for wallet in wallets]
+        # Statistics are written by the flush below, not by the logins
+        saved_interval = user_store.STATS_FLUSH_INTERVAL
+        user_store.STATS_FLUSH_INTERVAL = 3600
+        before = user_store.get_stats()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        after = user_store.get_stats()
+        user_store.STATS_FLUSH_INTERVAL = saved_interval
+        
+        user_store.flush_wallet_stats()
+        users_data = user_store.load_users_data()
+        _use_user_db(*saved_paths)
+    
+    logins = 2 * n_wallets
+    login_counts = {user['wallet_address']: user.get('login_count', 0) for user in users_data['web3_users']}
+    expected_counts = {address.lower(): 1 for address, _, _ in wallets}
+    expected_counts[shared[0].lower()] = n_wallets
+    
+    expected_chains = {'ethereum': {'users': 1, 'logins': 0}, 'solana': {'users': 0, 'logins': 0}}
+    for _, chain, _ in wallets + [shared] * n_wallets:
+        expected_chains[chain]['logins'] += 1
+    for _, chain, _ in wallets:
+        expected_chains[chain]['users'] += 1
+    
+    wallet_stats = users_data['wallet_stats'].values()
+    results = {
+        'wallets': n_wallets,
+        'logins': logins,
+        'seconds': round(elapsed, 3),
+        'logins_per_second': round(logins / elapsed, 1),
+        'reads_per_login': (after['reads'] - before['reads']) / logins,
+        'commits_per_login': (after['writes'] - before['writes']) / logins,
+        'errors': errors[:5],
+        'accounts_match': login_counts == expected_counts,
+        'chain_stats_match': users_data['chain_stats'] == expected_chains,
+        'wallet_stats_match': (
+            sum(stats['total_logins'] for stats in wallet_stats) == logins
+            and sum(stats['total_users'] for stats in wallet_stats) == n_wallets + 1
+        )
+    }
+    results['passed'] = (
+        not errors
+        and results['accounts_match']
+        and results['chain_stats_match']
+        and results['wallet_stats_match']
+        and results['reads_per_login'] == 1
+        and results['commits_per_login'] == 1
+    )
+    return results
+
+# Store sizes for the login throughput check, and the share of the
+# smallest store's throughput the largest must keep
+LOGIN_SCALING_SIZES = [1000, 100000]
+LOGIN_SCALING_TOLERANCE = 0.5
+
+def bench_login_scaling(sizes=LOGIN_SCALING_SIZES, n_logins=2000, seed=0):
+    """Web3 login throughput against the number of accounts in the store
+    
+    A login is one indexed lookup and one commit, with the statistics
+    buffered in memory, so the largest store must keep
+    LOGIN_SCALING_TOLERANCE of the smallest one's throughput. The flushed
+    statistics must count every login.
+    """
+    from logic import home, user_store
+    os.environ.setdefault('RECIPE_AI_WARMUP', '0')
+    import app as app_module
+    
+    rng = random.Random(seed)
+    saved_paths = (user_store.USER_DB_PATH, user_store.LEGACY_USERS_PATH)
+    results = {'logins': n_logins, 'sizes': {}}
+    for n_users in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            _use_user_db(os.path.join(directory, 'users.db'), os.path.join(directory, 'user.json'))
+            user_store.replace_users_data({'web3_users': [
+                {'username': f'bench_{i}', 'wallet_address': '0x%040x' % i, 'chain': 'ethereum',
+                 'wallet_type': 'metamask', 'login_count': 0, 'auth_type': 'web3'}
+                for i in range(n_users)
+            ]})
+            addresses = ['0x%040x' % rng.randrange(n_users) for _ in range(n_logins)]
+            
+            with app_module.app.test_request_context():
+                start = time.perf_counter()
+                for address in addresses:
+                    home.login_web3_user(address, 'ethereum', 'metamask')
+                elapsed = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            user_store.flush_wallet_stats()
+            flush_seconds = time.perf_counter() - start
+            counted = user_store.get_chain_stats()['ethereum']['logins']
+            _use_user_db(*saved_paths)
+        
+        results['sizes'][str(n_users)] = {
+            'logins_per_second': round(n_logins / elapsed, 1),
+            'flush_ms': round(flush_seconds * 1000, 3),
+            'all_counted': counted == n_logins
+        }
+    
+    throughputs = [size['logins_per_second'] for size in results['sizes'].values()]
+    results['ratio'] = round(throughputs[-1] / throughputs[0], 3)
+    results['passed'] = (
+        results['ratio'] >= LOGIN_SCALING_TOLERANCE
+        and all(size['all_counted'] for size in results['sizes'].values())
+    )
+    return results
+
+def legacy_get_analytics(users_data):
+    """Analytics the way they were computed before, by scanning every account"""
+    total_traditional = len(users_data.get("users", []))
+    total_web3 = len(users_data.get("web3_users", []))
+    chain_stats = users_data.get("chain_stats", {})
+    
+    ethereum_wallets = {}
+    solana_wallets = {}
+    for user in users_data.get("web3_users", []):
+        chain = user.get("chain", "ethereum")
+        wallet_type = user.get("wallet_type", "unknown")
+        if chain == "ethereum":
+            ethereum_wallets[wallet_type] = ethereum_wallets.get(wallet_type, 0) + 1
+        elif chain == "solana":
+            solana_wallets[wallet_type] = solana_wallets.get(wallet_type, 0) + 1
+    
+    total_users = total_traditional + total_web3
+    ethereum_users = chain_stats.get("ethereum", {}).get("users", 0)
+    solana_users = chain_stats.get("solana", {}).get("users", 0)
+    return {
+        "total_users": total_users,
+        "traditional_users": total_traditional,
+        "web3_users": total_web3,
+        "ethereum_users": ethereum_users,
+        "solana_users": solana_users,
+        "ethereum_wallets": ethereum_wallets,
+        "solana_wallets": solana_wallets,
+        "wallet_stats": users_data.get("wallet_stats", {}),
+        "chain_stats": chain_stats,
+        "web3_adoption_rate": (total_web3 / total_users) * 100 if total_users > 0 else 0,
+        "ethereum_adoption_rate": (ethereum_users / total_users) * 100 if total_users > 0 else 0,
+        "solana_adoption_rate": (solana_users / total_users) * 100 if total_users > 0 else 0,
+        "multi_chain_users": len([u for u in users_data.get("web3_users", []) if u.get("chain")])
+    }
+
+# Accounts in the store for the analytics check
+ANALYTICS_USERS = 100000
+
+def bench_analytics(n_users=ANALYTICS_USERS, n_logins=500, seed=0):
+    """Analytics from the maintained summary against a full recount
+    
+    Fills a store with n_users accounts, then registers and logs in more
+    through the normal paths, including wallets whose type becomes known
+    at login. The analytics must equal the legacy full scan, the summary
+    must match verify_user_summary(), and a Web3 login page view with the
+    cache warm must not read the store at all.
+    """
+    from logic import home, user_store
+    os.environ.setdefault('RECIPE_AI_WARMUP', '0')
+    import app as app_module
+    
+    rng = random.Random(seed)
+    wallet_types = {'ethereum': ['metamask', 'okx', 'coinbase', 'unknown'], 'solana': ['phantom', 'solflare', 'unknown']}
+    saved_paths = (user_store.USER_DB_PATH, user_store.LEGACY_USERS_PATH)
+    with tempfile.TemporaryDirectory() as directory:
+        _use_user_db(os.path.join(directory, 'users.db'), os.path.join(directory, 'user.json'))
+        users = [{'username': f'bench_{i}', 'email': f'bench_{i}@example.com', 'auth_type': 'traditional'}
+                 for i in range(n_users // 4)]
+        web3_users = []
+        for i in range(n_users - len(users)):
+            chain = rng.choice(['ethereum', 'solana'])
+            web3_users.append({'username': f'bench_web3_{i}', 'wallet_address': '0x%040x' % i, 'chain': chain,
+                               'wallet_type': rng.choice(wallet_types[chain]), 'auth_type': 'web3'})
+        user_store.replace_users_data({'users': users, 'web3_users': web3_users})
+        
+        with app_module.app.test_request_context():
+            for i in range(n_logins):
+                home.register_user(f'bench_new_{i}', f'bench_new_{i}@example.com', 'secret')
+                # A known wallet, which may learn its type, and a new one
+                known = rng.choice(web3_users)
+                chain = known['chain']
+                home.login_web3_user(known['wallet_address'], chain, rng.choice(wallet_types[chain]))
+                home.login_web3_user('0x%040x' % (n_users + i), 'ethereum', rng.choice(wallet_types['ethereum']))
+        
+        start = time.perf_counter()
+        expected = legacy_get_analytics(user_store.load_users_data())
+        full_scan = time.perf_counter() - start
+        
+        home.clear_analytics_cache()
+        start = time.perf_counter()
+        analytics = home.get_analytics()
+        from_summary = time.perf_counter() - start
+        
+        client = app_module.app.test_client()
+        before = user_store.get_stats()['reads']
+        client.get('/web3-login')
+        cached_reads = user_store.get_stats()['reads'] - before
+        
+        differences = user_store.verify_user_summary()
+        _use_user_db(*saved_paths)
+        home.clear_analytics_cache()
+    
+    mismatched = sorted(key for key in expected if expected[key] != analytics.get(key))
+    return {
+        'users': n_users + 2 * n_logins,
+        'full_scan_ms': round(full_scan * 1000, 3),
+        'summary_ms': round(from_summary * 1000, 3),
+        'cached_page_reads': cached_reads,
+        'mismatched_keys': mismatched,
+        'summary_differences': len(differences),
+        'passed': not mismatched and not differences and cached_reads == 0
+    }
+
+BENCHMARKS = {
+    'preprocess': bench_preprocess,
+    'import': bench_import,
+    'catalog': bench_catalog,
+    'typo': bench_typo,
+    'parse': bench_parse,
+    'user_reads': bench_user_reads,
+    'web3_logins': bench_web3_logins,
+    'login_scaling': bench_login_scaling,
+    'analytics': bench_analytics
+}
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m logic.benchmark')
+    parser.add_argument('benchmarks', nargs='*', help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=CATALOG_SIZES, help='catalog sizes to generate')
+    parser.add_argument('--output', default='benchmark-results.json', help='file the results are written to')
+    parser.add_argument('--queries', help='file with one user query per line for the parse benchmark')
+    parser.add_argument('--compare', help='earlier results file to compare catalog timings against')
+    args = parser.parse_args(argv)
+    
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}. Available: {', '.join(BENCHMARKS)}")
+            return 1
+    
+    report = {'meta': run_metadata()}
+    failed = False
+    for name in names:
+        if name == 'catalog':
+            results = bench_catalog(args.sizes)
+        elif name == 'parse':
+            results = bench_parse(args.queries)
+        else:
+            results = BENCHMARKS[name]()
+        print(json.dumps({name: results}, indent=4))
+        report[name] = results
+        failed = failed or results.get('passed') is False
+    
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {args.output}")
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare_catalog_results(json.load(file), report)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -311,15 +311,9 @@ def get_cryptsan_messages(user_id, username, limit=50):
 
 def get_web3_users():
     """Get list of Web3 user IDs"""
-    from .home import load_users
+    from .user_store import list_web3_user_ids
     
-    users_data = load_users()
-    web3_users = []
-    
-    if "web3_users" in users_data:
-        web3_users = [str(user["id"]) for user in users_data["web3_users"]]
-    
-    return web3_users
+    return [str(user_id) for user_id in list_web3_user_ids()]
 
 def get_chat_database_info():
     """Get CryptSan database information"""
@@ -1,11 +1,20 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify
-import json
-import os
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, g
 import hashlib
 from datetime import datetime
 import secrets
 import time
+import os
 import re
+import sqlite3
+import threading
+from . import user_store
+
+# Seconds the analytics on the Web3 login page and /api/analytics are cached
+ANALYTICS_CACHE_TTL = float(os.environ.get('RECIPE_ANALYTICS_TTL', '30'))
+
+# Cached analytics and when they expire (time.monotonic())
+_analytics_lock = threading.Lock()
+_analytics_cache = {'data': None, 'expires_at': 0.0}
 
 def get_home_content():
     """Get content for the home page"""
@@ -42,35 +51,16 @@ def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def load_users():
-    """Load users from JSON file"""
-    if os.path.exists('user.json'):
-        try:
-            with open('user.json', 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {
-                "users": [], 
-                "web3_users": [], 
-                "wallet_stats": {},
-                "chain_stats": {
-                    "ethereum": {"users": 0, "logins": 0},
-                    "solana": {"users": 0, "logins": 0}
-                }
-            }
-    return {
-        "users": [], 
-        "web3_users": [], 
-        "wallet_stats": {},
-        "chain_stats": {
-            "ethereum": {"users": 0, "logins": 0},
-            "solana": {"users": 0, "logins": 0}
-        }
-    }
+    """Load all users from the user store, in the shape user.json had
+    
+    This reads every account; lookups should use the find_user_* functions,
+    which go through the store's indexes.
+    """
+    return user_store.load_users_data()
 
 def save_users(users_data):
-    """Save users to JSON file"""
-    with open('user.json', 'w') as f:
-        json.dump(users_data, f, indent=4)
+    """Replace the whole user store with a user.json-shaped document"""
+    user_store.replace_users_data(users_data)
 
 def is_valid_address(address, chain):
     """Validate wallet address based on chain"""
@@ -85,40 +75,17 @@ def is_valid_address(address, chain):
 
 def find_user_by_username(username):
     """Find user by username"""
-    users_data = load_users()
-    for user in users_data["users"]:
-        if user["username"] == username:
-            return user
-    return None
+    return user_store.find_by_username(username)
 
 def find_user_by_wallet(wallet_address, chain=None):
     """Find user by wallet address, optionally filtered by chain"""
-    users_data = load_users()
-    if "web3_users" not in users_data:
-        users_data["web3_users"] = []
-        save_users(users_data)
-    
-    for user in users_data["web3_users"]:
-        if user["wallet_address"].lower() == wallet_address.lower():
-            # If chain is specified, ensure it matches
-            if chain and user.get("chain", "ethereum") != chain:
-                continue
-            return user
-    return None
+    if not wallet_address:
+        return None
+    return user_store.find_by_wallet(wallet_address, chain)
 
 def find_user_by_id(user_id):
     """Find user by ID"""
-    users_data = load_users()
-    for user in users_data["users"]:
-        if user["id"] == user_id:
-            return user
-    
-    # Check web3 users too
-    if "web3_users" in users_data:
-        for user in users_data["web3_users"]:
-            if user["id"] == user_id:
-                return user
-    return None
+    return user_store.find_by_id(user_id)
 
 def get_chain_info(chain):
     """Get chain information"""
@@ -275,42 +242,12 @@ def get_wallet_info(wallet_type, chain):
 
 def update_wallet_stats(wallet_type, chain, action="login"):
     """Update wallet and chain usage statistics"""
-    users_data = load_users()
-    
-    # Initialize stats if not present
-    if "wallet_stats" not in users_data:
-        users_data["wallet_stats"] = {}
-    if "chain_stats" not in users_data:
-        users_data["chain_stats"] = {
-            "ethereum": {"users": 0, "logins": 0},
-            "solana": {"users": 0, "logins": 0}
-        }
-    
-    # Update wallet stats
-    wallet_key = f"{wallet_type}_{chain}"
-    if wallet_key not in users_data["wallet_stats"]:
-        users_data["wallet_stats"][wallet_key] = {
-            "wallet_type": wallet_type,
-            "chain": chain,
-            "total_users": 0,
-            "total_logins": 0,
-            "last_used": None
-        }
-    
-    users_data["wallet_stats"][wallet_key]["total_logins"] += 1
-    users_data["wallet_stats"][wallet_key]["last_used"] = datetime.now().isoformat()
-    
-    if action == "register":
-        users_data["wallet_stats"][wallet_key]["total_users"] += 1
-    
-    # Update chain stats
-    if chain in users_data["chain_stats"]:
-        users_data["chain_stats"][chain]["logins"] += 1
-        if action == "register":
-            users_data["chain_stats"][chain]["users"] += 1
-    
-    save_users(users_data)
-    return users_data["wallet_stats"], users_data["chain_stats"]
+    user_store.record_wallet_use(
+        wallet_type, chain,
+        users=1 if action == "register" else 0,
+        last_used=datetime.now().isoformat()
+    )
+    return user_store.get_wallet_stats(), user_store.get_chain_stats()
 
 def register_user(username, email, password):
     """Register a new user"""
@@ -318,17 +255,12 @@ def register_user(username, email, password):
     if find_user_by_username(username):
         return False, "Username already exists"
     
-    # Load existing users
-    users_data = load_users()
-    
     # Check if email already exists
-    for user in users_data["users"]:
-        if user["email"] == email:
-            return False, "Email already registered"
+    if user_store.find_by_email(email):
+        return False, "Email already registered"
     
-    # Create new user
+    # Create new user; the store assigns the next ID
     new_user = {
-        "id": len(users_data["users"]) + len(users_data.get("web3_users", [])) + 1,
         "username": username,
         "email": email,
         "password": hash_password(password),
@@ -337,60 +269,52 @@ def register_user(username, email, password):
         "auth_type": "traditional"
     }
     
-    # Add to users list
-    users_data["users"].append(new_user)
-    
-    # Save to file
-    save_users(users_data)
+    try:
+        user_store.insert_user(new_user)
+    except sqlite3.IntegrityError:
+        # Someone else registered the same name or email in the meantime
+        return False, "Username or email already registered"
     
     return True, "Registration successful"
 
-def register_web3_user(wallet_address, chain, username=None, wallet_type="unknown"):
-    """Register a new Web3 user with multi-chain support"""
-    # Validate address format
-    if not is_valid_address(wallet_address, chain):
-        return False, f"Invalid {chain} address format"
-    
-    # Check if wallet already exists (same address + chain combination)
-    if find_user_by_wallet(wallet_address, chain):
-        return False, f"Wallet already registered on {chain}"
-    
-    # Load existing users
-    users_data = load_users()
-    
-    # Ensure web3_users array exists
-    if "web3_users" not in users_data:
-        users_data["web3_users"] = []
+def _new_web3_user(wallet_address, chain, username=None, wallet_type="unknown"):
+    """Record for a wallet that has not been seen before"""
+    wallet_info = get_wallet_info(wallet_type, chain)
+    chain_info = get_chain_info(chain)
     
     # Generate username if not provided
     if not username:
-        wallet_info = get_wallet_info(wallet_type, chain)
-        chain_info = get_chain_info(chain)
         username = f"{wallet_info['name']}_{chain_info['symbol']}_User_{wallet_address[:8]}"
     
-    # Create new Web3 user
-    new_user = {
-        "id": len(users_data["users"]) + len(users_data["web3_users"]) + 1,
+    return {
         "username": username,
         "wallet_address": wallet_address.lower(),
         "chain": chain,  # NEW: Store blockchain network
         "wallet_type": wallet_type,
-        "wallet_info": get_wallet_info(wallet_type, chain),
-        "chain_info": get_chain_info(chain),  # NEW: Store chain metadata
+        "wallet_info": wallet_info,
+        "chain_info": chain_info,  # NEW: Store chain metadata
         "created_at": datetime.now().isoformat(),
         "last_login": None,
         "login_count": 0,
         "auth_type": "web3"
     }
+
+def register_web3_user(wallet_address, chain, username=None, wallet_type="unknown"):
+    """Register a new Web3 user with multi-chain support"""
+    # Validate address format
+    if not is_valid_address(wallet_address, chain):
+        return False, f"Invalid {chain} address format"
     
-    # Add to web3 users list
-    users_data["web3_users"].append(new_user)
+    with user_store.transaction():
+        # Check if wallet already exists (same address + chain combination)
+        if find_user_by_wallet(wallet_address, chain):
+            return False, f"Wallet already registered on {chain}"
+        
+        new_user = _new_web3_user(wallet_address, chain, username, wallet_type)
+        user_store.insert_user(new_user)
     
     # Update statistics
-    update_wallet_stats(wallet_type, chain, "register")
-    
-    # Save to file
-    save_users(users_data)
+    user_store.record_wallet_use(wallet_type, chain, users=1, last_used=new_user["created_at"])
     
     wallet_info = get_wallet_info(wallet_type, chain)
     chain_info = get_chain_info(chain)
@@ -408,14 +332,9 @@ def login_user(username, password):
         return False, "Incorrect password"
     
     # Update last login
-    users_data = load_users()
-    for i, u in enumerate(users_data["users"]):
-        if u["username"] == username:
-            users_data["users"][i]["last_login"] = datetime.now().isoformat()
-            users_data["users"][i]["login_count"] = users_data["users"][i].get("login_count", 0) + 1
-            break
-    
-    save_users(users_data)
+    user["last_login"] = datetime.now().isoformat()
+    user["login_count"] = user.get("login_count", 0) + 1
+    user_store.update_user(user)
     
     # Set session
     session['user_id'] = user["id"]
@@ -423,6 +342,7 @@ def login_user(username, password):
     session['auth_type'] = user.get("auth_type", "traditional")
     session['logged_in'] = True
     session.permanent = True
+    forget_current_user()
     
     return True, "Login successful"
 
@@ -432,33 +352,38 @@ def login_web3_user(wallet_address, chain, wallet_type="unknown"):
     if not is_valid_address(wallet_address, chain):
         return False, f"Invalid {chain} address format"
     
-    user = find_user_by_wallet(wallet_address, chain)
-    
-    if not user:
-        # Auto-register new wallet with chain and wallet type
-        success, message = register_web3_user(wallet_address, chain, wallet_type=wallet_type)
-        if not success:
-            return False, message
+    # Lookup, auto-registration and login count are one transaction: one
+    # read and one commit, and a concurrent login of the same wallet waits
+    # for this one instead of overwriting it
+    now = datetime.now().isoformat()
+    with user_store.transaction():
         user = find_user_by_wallet(wallet_address, chain)
-    
-    # Update last login and login count
-    users_data = load_users()
-    for i, u in enumerate(users_data["web3_users"]):
-        if (u["wallet_address"].lower() == wallet_address.lower() and 
-            u.get("chain", "ethereum") == chain):
-            users_data["web3_users"][i]["last_login"] = datetime.now().isoformat()
-            users_data["web3_users"][i]["login_count"] = users_data["web3_users"][i].get("login_count", 0) + 1
-            
+        registering = user is None
+        
+        if registering:
+            # Auto-register new wallet with chain and wallet type
+            user = _new_web3_user(wallet_address, chain, wallet_type=wallet_type)
+        elif user.get("wallet_type", "unknown") == "unknown" and wallet_type != "unknown":
             # Update wallet type if it was unknown before
-            if users_data["web3_users"][i].get("wallet_type", "unknown") == "unknown" and wallet_type != "unknown":
-                users_data["web3_users"][i]["wallet_type"] = wallet_type
-                users_data["web3_users"][i]["wallet_info"] = get_wallet_info(wallet_type, chain)
-            break
-    
-    # Update statistics
-    update_wallet_stats(user.get("wallet_type", wallet_type), chain)
+            user["wallet_type"] = wallet_type
+            user["wallet_info"] = get_wallet_info(wallet_type, chain)
+        
+        # Update last login and login count
+        user["last_login"] = now
+        user["login_count"] = user.get("login_count", 0) + 1
+        
+        if registering:
+            user = user_store.insert_user(user)
+        else:
+            user_store.update_user(user)
     
-    save_users(users_data)
+    # Update statistics once the login is committed; a first login counts
+    # once, as the registration
+    user_store.record_wallet_use(
+        user.get("wallet_type", wallet_type), chain,
+        users=1 if registering else 0,
+        last_used=now
+    )
     
     # Set session with wallet and chain info
     session['user_id'] = user["id"]
@@ -469,6 +394,7 @@ def login_web3_user(wallet_address, chain, wallet_type="unknown"):
     session['auth_type'] = "web3"
     session['logged_in'] = True
     session.permanent = True
+    forget_current_user()
     
     wallet_info = get_wallet_info(user.get("wallet_type", wallet_type), chain)
     chain_info = get_chain_info(chain)
@@ -501,13 +427,28 @@ By signing, you agree to our Terms of Service."""
 def logout_user():
     """Logout user by clearing session"""
     session.clear()
+    forget_current_user()
 
 def is_logged_in():
     """Check if user is logged in"""
     return session.get('logged_in', False)
 
 def get_current_user():
-    """Get current logged in user with enhanced multi-chain info"""
+    """Get current logged in user with enhanced multi-chain info
+    
+    The user is resolved at most once per request and memoized on flask.g;
+    templates, handlers and the context processor all share that copy.
+    """
+    if 'current_user' not in g:
+        g.current_user = _resolve_current_user()
+    return g.current_user
+
+def forget_current_user():
+    """Drop the memoized user after the session's user changes"""
+    g.pop('current_user', None)
+
+def _resolve_current_user():
+    """Look up the session's user in the user store"""
     if is_logged_in():
         user_id = session.get('user_id')
         auth_type = session.get('auth_type', 'traditional')
@@ -556,26 +497,42 @@ def get_current_user():
     return None
 
 def get_analytics():
-    """Get comprehensive analytics including multi-chain data"""
-    users_data = load_users()
-    
-    total_traditional = len(users_data.get("users", []))
-    total_web3 = len(users_data.get("web3_users", []))
-    wallet_stats = users_data.get("wallet_stats", {})
-    chain_stats = users_data.get("chain_stats", {})
+    """Get comprehensive analytics including multi-chain data
+    
+    Built from the store's account summary and statistics, which logins
+    and registrations keep current, and cached for ANALYTICS_CACHE_TTL
+    seconds. The login page shows it to anonymous visitors, so it must
+    never read every account.
+    """
+    with _analytics_lock:
+        if _analytics_cache['data'] is None or _analytics_cache['expires_at'] < time.monotonic():
+            _analytics_cache['data'] = _build_analytics(
+                user_store.get_user_summary(),
+                user_store.get_wallet_stats(),
+                user_store.get_chain_stats()
+            )
+            _analytics_cache['expires_at'] = time.monotonic() + ANALYTICS_CACHE_TTL
+        return dict(_analytics_cache['data'])
+
+def clear_analytics_cache():
+    """Make the next get_analytics() rebuild its result"""
+    with _analytics_lock:
+        _analytics_cache['data'] = None
+
+def _build_analytics(summary, wallet_stats, chain_stats):
+    """Analytics from accounts per (chain, wallet_type), as user_store.get_user_summary() returns"""
+    total_traditional = summary.get(("", ""), 0)
+    total_web3 = sum(count for (chain, _), count in summary.items() if chain)
     
     # Calculate wallet distribution by chain
     ethereum_wallets = {}
     solana_wallets = {}
     
-    for user in users_data.get("web3_users", []):
-        chain = user.get("chain", "ethereum")
-        wallet_type = user.get("wallet_type", "unknown")
-        
+    for (chain, wallet_type), count in sorted(summary.items()):
         if chain == "ethereum":
-            ethereum_wallets[wallet_type] = ethereum_wallets.get(wallet_type, 0) + 1
+            ethereum_wallets[wallet_type] = count
         elif chain == "solana":
-            solana_wallets[wallet_type] = solana_wallets.get(wallet_type, 0) + 1
+            solana_wallets[wallet_type] = count
     
     # Calculate chain adoption rates
     total_users = total_traditional + total_web3
@@ -595,7 +552,8 @@ def get_analytics():
         "web3_adoption_rate": (total_web3 / total_users) * 100 if total_users > 0 else 0,
         "ethereum_adoption_rate": (ethereum_users / total_users) * 100 if total_users > 0 else 0,
         "solana_adoption_rate": (solana_users / total_users) * 100 if total_users > 0 else 0,
-        "multi_chain_users": len([u for u in users_data.get("web3_users", []) if u.get("chain")])
+        # Every Web3 account records its chain; older ones default to Ethereum
+        "multi_chain_users": total_web3
     }
 
 def render_home_page():
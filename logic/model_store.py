@@ -0,0 +1,544 @@
+import contextlib
+import json
+import os
+import shutil
+import time
+import secrets
+import struct
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; run a single worker there
+    fcntl = None
+
+# Bump when the on-disk layout changes
+ARTIFACT_FORMAT = 1
+
+# Manifest inside the models directory naming the active version and the
+# versions that were active before it, most recent first
+ACTIVE_FILE = 'ACTIVE'
+
+# Number of previously active versions remembered for rollback
+HISTORY_LENGTH = 10
+
+# Number of most recent versions kept on disk; older ones are deleted
+KEEP_VERSIONS = int(os.environ.get('RECIPE_KEEP_MODEL_VERSIONS', '2'))
+
+# Lock file in the models directory, held by whichever process is training
+# or saving a model
+TRAINING_LOCK_FILE = '.training.lock'
+
+# Bytes reserved for the header of .npy files written a piece at a time
+NPY_HEADER_SIZE = 128
+
+class RecipeTable:
+    """Compact, read-only recipe table backed by flat numpy buffers
+
+    Each recipe's name and instructions are stored as a UTF-8 JSON record in
+    one byte blob and its ingredient list in a second blob, both addressed
+    by offset arrays. Ingredients can be scanned without decoding
+    instructions, and a table loaded with mmap is shared through the page
+    cache by every worker process instead of being copied into each one.
+    """
+
+    def __init__(self, details, detail_offsets, ingredients, ingredient_offsets):
+        self.details = details
+        self.detail_offsets = detail_offsets
+        self.ingredients = ingredients
+        self.ingredient_offsets = ingredient_offsets
+
+    @classmethod
+    def from_records(cls, recipes):
+        """Build an in-memory table from recipe dicts"""
+        details = []
+        ingredients = []
+        for recipe in recipes:
+            details.append(json.dumps([recipe['name'], recipe['instructions']], ensure_ascii=False).encode('utf-8'))
+            ingredients.append(json.dumps(list(recipe['ingredients']), ensure_ascii=False).encode('utf-8'))
+
+        return cls(*_pack(details), *_pack(ingredients))
+
+    @classmethod
+    def concat(cls, tables):
+        """Concatenate tables into a new in-memory table"""
+        details, detail_offsets = _concat_packed([(t.details, t.detail_offsets) for t in tables])
+        ingredients, ingredient_offsets = _concat_packed([(t.ingredients, t.ingredient_offsets) for t in tables])
+        return cls(details, detail_offsets, ingredients, ingredient_offsets)
+
+    def __len__(self):
+        return len(self.detail_offsets) - 1
+
+    def __getitem__(self, idx):
+        name, instructions = _unpack(self.details, self.detail_offsets, idx)
+        return {
+            'name': name,
+            'ingredients': self.get_ingredients(idx),
+            'instructions': instructions
+        }
+
+    def get_ingredients(self, idx):
+        """Ingredient list of one recipe"""
+        return _unpack(self.ingredients, self.ingredient_offsets, idx)
+
+    def iter_ingredients(self):
+        """Ingredient lists of all recipes, in order"""
+        for idx in range(len(self)):
+            yield self.get_ingredients(idx)
+
+    def startswith(self, other):
+        """Whether the first len(other) recipes of this table are other's recipes"""
+        if len(other) > len(self):
+            return False
+        for blob, offsets in (('details', 'detail_offsets'), ('ingredients', 'ingredient_offsets')):
+            end = int(getattr(other, offsets)[-1])
+            if not (_equal_arrays(getattr(self, offsets)[:len(other) + 1], getattr(other, offsets))
+                    and _equal_arrays(getattr(self, blob)[:end], getattr(other, blob)[:end])):
+                return False
+        return True
+
+    def save(self, directory):
+        np.save(os.path.join(directory, 'recipe_details.npy'), self.details)
+        np.save(os.path.join(directory, 'recipe_detail_offsets.npy'), self.detail_offsets)
+        np.save(os.path.join(directory, 'recipe_ingredients.npy'), self.ingredients)
+        np.save(os.path.join(directory, 'recipe_ingredient_offsets.npy'), self.ingredient_offsets)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        return cls(*[
+            np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in ('recipe_details', 'recipe_detail_offsets', 'recipe_ingredients', 'recipe_ingredient_offsets')
+        ])
+
+class _ArrayWriter:
+    """Write a 1-D .npy file a piece at a time
+
+    Its length is only known at the end, so space for the header is
+    reserved up front and the header is filled in by close().
+    """
+
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.file = open(path, 'wb')
+        self.file.write(b'\x00' * NPY_HEADER_SIZE)
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        self.file.write(array.data)
+        self.length += len(array)
+
+    def close(self):
+        # Format 1.0 headers are a dict literal padded with spaces to a newline
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (self.length,)})
+        header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+        self.file.seek(0)
+        self.file.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self.file.close()
+
+class RecipeTableWriter:
+    """Build a RecipeTable in a directory one chunk of recipes at a time
+
+    Only the chunk being appended is held in memory. close() returns the
+    finished table memory-mapped from the directory.
+    """
+
+    # (blob, offsets) attribute pairs of RecipeTable, saved as recipe_<attribute>.npy
+    PARTS = (('details', 'detail_offsets'), ('ingredients', 'ingredient_offsets'))
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._writers = []
+        for blob, offsets in self.PARTS:
+            offset_writer = _ArrayWriter(os.path.join(directory, f'recipe_{offsets}.npy'), np.int64)
+            offset_writer.append(np.zeros(1))
+            self._writers.append((_ArrayWriter(os.path.join(directory, f'recipe_{blob}.npy'), np.uint8), offset_writer))
+
+    def append(self, table):
+        for (blob, offsets), (blob_writer, offset_writer) in zip(self.PARTS, self._writers):
+            offset_writer.append(np.asarray(getattr(table, offsets)[1:]) + blob_writer.length)
+            blob_writer.append(getattr(table, blob))
+
+    def close(self):
+        for blob_writer, offset_writer in self._writers:
+            blob_writer.close()
+            offset_writer.close()
+        return RecipeTable.load(self.directory)
+
+class CsrWriter:
+    """Build a CSR matrix in a directory one block of rows at a time
+
+    The files are the ones save_artifact writes for `name`, so a staging
+    directory holding them needs no second copy. close() returns the
+    matrix memory-mapped.
+    """
+
+    def __init__(self, directory, name, index_dtype=np.int32):
+        self.directory = directory
+        self.name = name
+        self.n_rows = 0
+        self._data = _ArrayWriter(os.path.join(directory, f'{name}_data.npy'), np.float64)
+        self._indices = _ArrayWriter(os.path.join(directory, f'{name}_indices.npy'), index_dtype)
+        self._indptr = _ArrayWriter(os.path.join(directory, f'{name}_indptr.npy'), index_dtype)
+        self._indptr.append(np.zeros(1))
+
+    def append(self, matrix):
+        self._indptr.append(np.asarray(matrix.indptr[1:], dtype=np.int64) + self._data.length)
+        self._indices.append(matrix.indices)
+        self._data.append(matrix.data)
+        self.n_rows += matrix.shape[0]
+
+    def close(self, n_columns):
+        for writer in (self._data, self._indices, self._indptr):
+            writer.close()
+        return load_csr(self.directory, self.name, (self.n_rows, n_columns), 'r')
+
+def _pack(records):
+    """Concatenate encoded records into (blob, offsets)"""
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(record) for record in records])
+    return np.frombuffer(b''.join(records), dtype=np.uint8), offsets
+
+def _concat_packed(parts):
+    """Concatenate several (blob, offsets) pairs"""
+    blobs = [blob for blob, _ in parts]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for blob, part_offsets in parts:
+        offsets.append(np.asarray(part_offsets[1:]) + base)
+        base += len(blob)
+    return np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8), np.concatenate(offsets)
+
+def _equal_arrays(a, b, block_size=1 << 24):
+    """np.array_equal, a block at a time so memory-mapped arrays aren't read in whole"""
+    if len(a) != len(b):
+        return False
+    return all(
+        np.array_equal(a[start:start + block_size], b[start:start + block_size])
+        for start in range(0, len(a), block_size)
+    )
+
+def _unpack(blob, offsets, idx):
+    """Decode one JSON record"""
+    return json.loads(blob[offsets[idx]:offsets[idx + 1]].tobytes().decode('utf-8'))
+
+def save_csr(directory, name, matrix):
+    np.save(os.path.join(directory, f'{name}_data.npy'), matrix.data)
+    np.save(os.path.join(directory, f'{name}_indices.npy'), matrix.indices)
+    np.save(os.path.join(directory, f'{name}_indptr.npy'), matrix.indptr)
+
+def load_csr(directory, name, shape, mmap_mode='r'):
+    arrays = [
+        np.load(os.path.join(directory, f'{name}_{part}.npy'), mmap_mode=mmap_mode)
+        for part in ('data', 'indices', 'indptr')
+    ]
+    return sp.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+def save_transposed_csr(directory, name, matrix, block_rows=10000):
+    """Write the transpose of a CSR matrix into a directory, as CSR
+
+    The result has the arrays matrix.T.tocsr() would have, but the transpose
+    is never built in memory: each block of rows is scattered straight into
+    memory-mapped output files. Returns the transpose memory-mapped.
+    """
+    n_rows, n_columns = matrix.shape
+    column_counts = np.zeros(n_columns, dtype=np.int64)
+    for start in range(0, n_rows, block_rows):
+        column_counts += np.bincount(matrix[start:start + block_rows].indices, minlength=n_columns)
+    indptr = np.zeros(n_columns + 1, dtype=np.int64)
+    np.cumsum(column_counts, out=indptr[1:])
+    index_dtype = np.int32 if max(matrix.nnz, n_rows, n_columns) < 2 ** 31 else np.int64
+    np.save(os.path.join(directory, f'{name}_indptr.npy'), indptr.astype(index_dtype))
+
+    data = np.lib.format.open_memmap(
+        os.path.join(directory, f'{name}_data.npy'), mode='w+', dtype=matrix.data.dtype, shape=(matrix.nnz,)
+    )
+    indices = np.lib.format.open_memmap(
+        os.path.join(directory, f'{name}_indices.npy'), mode='w+', dtype=index_dtype, shape=(matrix.nnz,)
+    )
+    next_position = indptr[:-1].copy()
+    for start in range(0, n_rows, block_rows):
+        block = matrix[start:start + block_rows]
+        rows = start + np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        # Within a column, entries keep their row order
+        order = np.argsort(block.indices, kind='stable')
+        columns = block.indices[order]
+        positions = next_position[columns] + np.arange(len(columns)) - np.searchsorted(columns, columns)
+        data[positions] = block.data[order]
+        indices[positions] = rows[order]
+        next_position += np.bincount(columns, minlength=n_columns)
+    data.flush()
+    indices.flush()
+    del data, indices
+
+    return load_csr(directory, name, (n_columns, n_rows))
+
+def get_active_path(models_dir):
+    return os.path.join(models_dir, ACTIVE_FILE)
+
+def read_manifest(models_dir):
+    """Return the manifest {'version', 'activated_at', 'history'}, or None if no model was saved yet"""
+    try:
+        with open(get_active_path(models_dir), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or 'version' not in manifest:
+        return None
+    # Manifests written before the history existed only name the version
+    manifest.setdefault('history', [])
+    return manifest
+
+def read_active_version(models_dir):
+    """Return the active model version, or None if no model was saved yet"""
+    manifest = read_manifest(models_dir)
+    return manifest['version'] if manifest else None
+
+def _write_manifest(models_dir, version, history):
+    """Replace the manifest with an atomic rename"""
+    temp_path = f"{get_active_path(models_dir)}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': version, 'activated_at': time.time(), 'history': history[:HISTORY_LENGTH]}, file)
+    os.replace(temp_path, get_active_path(models_dir))
+
+def _write_active_version(models_dir, version):
+    """Point ACTIVE at a version, remembering the one it replaces
+
+    Rewriting the active version keeps the history as it is; workers still
+    see a new manifest and reload.
+    """
+    manifest = read_manifest(models_dir) or {'version': None, 'history': []}
+    history = [entry for entry in manifest['history'] if entry != version]
+    if manifest['version'] not in (None, version):
+        history.insert(0, manifest['version'])
+    _write_manifest(models_dir, version, history)
+
+def list_versions(models_dir):
+    """Saved versions, oldest first"""
+    if not os.path.isdir(models_dir):
+        return []
+    return sorted(
+        entry for entry in os.listdir(models_dir)
+        if not entry.startswith('.') and os.path.exists(os.path.join(models_dir, entry, 'meta.json'))
+    )
+
+def activate_version(models_dir, version):
+    """Make a saved version the active one
+
+    Only the manifest changes, so switching is instant: workers notice the
+    new manifest and load the version, which is already on disk.
+    """
+    if version not in list_versions(models_dir):
+        raise ValueError(f"Model version {version} does not exist")
+    _write_active_version(models_dir, version)
+
+def rollback(models_dir):
+    """Re-activate the version that was active before the current one
+
+    Versions that were since deleted are skipped. The version rolled back
+    from is not added to the history, so repeated rollbacks keep stepping
+    back. Returns the re-activated version, or None if there is none.
+    """
+    manifest = read_manifest(models_dir)
+    if manifest is None:
+        return None
+
+    saved = set(list_versions(models_dir))
+    history = manifest['history']
+    for position, version in enumerate(history):
+        if version in saved:
+            _write_manifest(models_dir, version, history[position + 1:])
+            return version
+    return None
+
+def _prune_versions(models_dir, keep):
+    """Delete all but the newest `keep` versions
+
+    The active version and the `keep - 1` most recent entries of the
+    history survive as well, so a rollback always has somewhere to go.
+    Workers that still have an old version memory-mapped keep reading it:
+    the files stay alive until they are unmapped.
+    """
+    manifest = read_manifest(models_dir) or {'version': None, 'history': []}
+    protected = {manifest['version']} | set(manifest['history'][:max(keep - 1, 0)])
+    versions = sorted(
+        entry for entry in os.listdir(models_dir)
+        if os.path.isdir(os.path.join(models_dir, entry)) and not entry.startswith('.')
+    )
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version not in protected:
+            shutil.rmtree(os.path.join(models_dir, version), ignore_errors=True)
+
+@contextlib.contextmanager
+def training_lock(models_dir):
+    """Hold the models directory's training lock for the block, waiting for it
+
+    Processes serving the same models directory take it before training
+    or saving, so at most one of them writes versions at a time.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    with open(os.path.join(models_dir, TRAINING_LOCK_FILE), 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+def _new_version_name():
+    """Version names sort chronologically, down to the nanosecond"""
+    now = time.time_ns()
+    timestamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now // 1_000_000_000))
+    return f"{timestamp}-{now % 1_000_000_000:09d}-{secrets.token_hex(2)}"
+
+@contextlib.contextmanager
+def staging_directory(models_dir):
+    """A hidden directory a version can be built in before save_artifact publishes it
+
+    It is deleted when the block ends unless save_artifact moved it into
+    place, so a failed training leaves nothing behind.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    directory = os.path.join(models_dir, '.' + _new_version_name())
+    os.makedirs(directory)
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def save_artifact(models_dir, terms, idf, tfidf_matrix, postings, recipes, ingredient_index, fit_info, pruned_terms=(),
+                  directory=None, neighbors=None):
+    """Write a model as flat arrays into a new version directory and activate it
+
+    ingredient_index is (ingredients, bits, counts, frequencies) as built by
+    ai.build_ingredient_index. pruned_terms are the terms the fit dropped by
+    document frequency, which incremental updates must keep out. neighbors
+    is the (neighbors, scores) similar-recipes table, if any.
+
+    The version is written to a hidden temporary directory and renamed into
+    place before ACTIVE is switched, so readers never see a partial model.
+    That is `directory` when given: a staging directory that already holds
+    the large arrays (the TF-IDF matrix, its postings, the recipe table and
+    the ingredient bitsets), written there while training. Returns the new
+    version name.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    version = _new_version_name()
+    ingredients, ingredient_bits, ingredient_counts, ingredient_frequencies = ingredient_index
+    if directory is None:
+        temp_dir = os.path.join(models_dir, '.' + version)
+        os.makedirs(temp_dir)
+        save_csr(temp_dir, 'tfidf', tfidf_matrix.tocsr())
+        save_csr(temp_dir, 'postings', postings.tocsr())
+        recipes.save(temp_dir)
+        np.save(os.path.join(temp_dir, 'ingredient_bits.npy'), ingredient_bits)
+    else:
+        temp_dir = directory
+
+    np.save(os.path.join(temp_dir, 'idf.npy'), np.asarray(idf))
+    if neighbors is not None:
+        np.save(os.path.join(temp_dir, 'neighbors.npy'), neighbors[0])
+        np.save(os.path.join(temp_dir, 'neighbor_scores.npy'), neighbors[1])
+    np.save(os.path.join(temp_dir, 'ingredient_counts.npy'), ingredient_counts)
+    np.save(os.path.join(temp_dir, 'ingredient_frequencies.npy'), ingredient_frequencies)
+    with open(os.path.join(temp_dir, 'ingredients.json'), 'w', encoding='utf-8') as file:
+        json.dump(list(ingredients), file, ensure_ascii=False)
+
+    with open(os.path.join(temp_dir, 'vocabulary.json'), 'w', encoding='utf-8') as file:
+        json.dump(list(terms), file, ensure_ascii=False)
+    with open(os.path.join(temp_dir, 'pruned_terms.json'), 'w', encoding='utf-8') as file:
+        json.dump(list(pruned_terms), file, ensure_ascii=False)
+
+    with open(os.path.join(temp_dir, 'meta.json'), 'w', encoding='utf-8') as file:
+        json.dump({
+            'format': ARTIFACT_FORMAT,
+            'version': version,
+            'n_recipes': tfidf_matrix.shape[0],
+            'n_terms': tfidf_matrix.shape[1],
+            'fit_info': fit_info
+        }, file)
+
+    os.rename(temp_dir, os.path.join(models_dir, version))
+    _write_active_version(models_dir, version)
+    _prune_versions(models_dir, KEEP_VERSIONS)
+    return version
+
+def save_neighbors(models_dir, version, neighbors, scores):
+    """Store a similar-recipes table in an existing version directory
+
+    The files are written under temporary names and renamed into place. If
+    the version is still active, ACTIVE is rewritten so running workers
+    notice the change and reload the model with the table.
+    """
+    directory = os.path.join(models_dir, version)
+    # neighbors.npy marks the table as present, so it is renamed in last
+    for name, array in (('neighbor_scores', scores), ('neighbors', neighbors)):
+        temp_path = os.path.join(directory, f'.{name}.{os.getpid()}.npy')
+        np.save(temp_path, array)
+        os.replace(temp_path, os.path.join(directory, f'{name}.npy'))
+
+    if read_active_version(models_dir) == version:
+        _write_active_version(models_dir, version)
+
+def load_artifact(models_dir, version=None, mmap_mode='r'):
+    """Load a saved model version (the active one by default)
+
+    Arrays are memory-mapped read-only; only the vocabulary and ingredient
+    names are parsed into process memory. Versions saved before the
+    ingredient index existed load with ingredient_index set to None, and
+    neighbors is None for versions saved without a similar-recipes table.
+    Returns None if there is no saved model.
+    """
+    version = version or read_active_version(models_dir)
+    if version is None:
+        return None
+
+    directory = os.path.join(models_dir, version)
+    with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    if meta['format'] != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported model artifact format {meta['format']}")
+
+    with open(os.path.join(directory, 'vocabulary.json'), 'r', encoding='utf-8') as file:
+        terms = json.load(file)
+
+    # Versions saved before pruned terms were recorded have none
+    pruned_terms = []
+    if os.path.exists(os.path.join(directory, 'pruned_terms.json')):
+        with open(os.path.join(directory, 'pruned_terms.json'), 'r', encoding='utf-8') as file:
+            pruned_terms = json.load(file)
+
+    ingredient_index = None
+    if os.path.exists(os.path.join(directory, 'ingredient_frequencies.npy')):
+        with open(os.path.join(directory, 'ingredients.json'), 'r', encoding='utf-8') as file:
+            ingredients = json.load(file)
+        ingredient_index = (
+            ingredients,
+            np.load(os.path.join(directory, 'ingredient_bits.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'ingredient_counts.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'ingredient_frequencies.npy'), mmap_mode=mmap_mode)
+        )
+
+    neighbors = None
+    if os.path.exists(os.path.join(directory, 'neighbors.npy')):
+        neighbors = (
+            np.load(os.path.join(directory, 'neighbors.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'neighbor_scores.npy'), mmap_mode=mmap_mode)
+        )
+
+    shape = (meta['n_recipes'], meta['n_terms'])
+    return {
+        'artifact_version': version,
+        'terms': terms,
+        'pruned_terms': pruned_terms,
+        'idf': np.load(os.path.join(directory, 'idf.npy'), mmap_mode=mmap_mode),
+        'tfidf_matrix': load_csr(directory, 'tfidf', shape, mmap_mode),
+        'postings': load_csr(directory, 'postings', shape[::-1], mmap_mode),
+        'recipes': RecipeTable.load(directory, mmap_mode),
+        'ingredient_index': ingredient_index,
+        'neighbors': neighbors,
+        'fit_info': meta['fit_info']
+    }
@@ -0,0 +1,628 @@
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Embedded database holding all user accounts
+USER_DB_PATH = os.environ.get('RECIPE_USER_DB', 'users.db')
+
+# JSON file users were kept in before; imported once into the database
+LEGACY_USERS_PATH = 'user.json'
+
+# Seconds a writer waits for another process's transaction to finish; long
+# enough for a worker that starts during the one-time import to wait it out
+BUSY_TIMEOUT = 30.0
+
+# Seconds wallet and chain statistics are buffered in memory before they
+# are written. A process that crashes loses at most the counts of its last
+# interval; a clean shutdown writes them out.
+STATS_FLUSH_INTERVAL = float(os.environ.get('RECIPE_STATS_FLUSH_INTERVAL', '5'))
+
+# Columns kept out of the JSON record because they are indexed or assigned
+# by the database
+_COLUMNS = ('id', 'auth_type', 'username', 'email', 'wallet_address', 'chain')
+
+# Thread-local storage for database connections
+thread_local = threading.local()
+
+# Queries and committed write transactions, for monitoring and checks
+_stats_lock = threading.Lock()
+_stats = {'reads': 0, 'writes': 0}
+
+def _count(kind):
+    """Count one read or write"""
+    with _stats_lock:
+        _stats[kind] += 1
+
+def get_stats():
+    """Counters of reads and committed write transactions so far"""
+    with _stats_lock:
+        return dict(_stats)
+
+# Wallet statistics not yet written: (wallet_type, chain) -> [users, logins, last_used]
+_pending_lock = threading.Lock()
+_pending_wallets = {}
+_flush_timer = None
+
+def empty_users_data():
+    """The users document of a store with nobody in it"""
+    return {
+        "users": [],
+        "web3_users": [],
+        "wallet_stats": {},
+        "chain_stats": {
+            "ethereum": {"users": 0, "logins": 0},
+            "solana": {"users": 0, "logins": 0}
+        }
+    }
+
+def get_db_connection():
+    """Get thread-safe database connection"""
+    if not hasattr(thread_local, 'conn'):
+        # Autocommit mode: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(USER_DB_PATH, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers in other processes carry on while one writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        thread_local.conn = conn
+        thread_local.depth = 0
+        init_database_schema(conn)
+        migrate_from_json(LEGACY_USERS_PATH)
+        _migrate_stats_metadata()
+        _build_user_summary()
+    return thread_local.conn
+
+def init_database_schema(conn):
+    """Initialize database schema"""
+    # One row per account. Lookup keys are columns with indexes; the rest
+    # of the record is stored as JSON so new fields need no migration.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            auth_type TEXT NOT NULL,
+            username TEXT NOT NULL,
+            email TEXT,
+            wallet_address TEXT,
+            chain TEXT,
+            data TEXT NOT NULL
+        )
+    ''')
+
+    # Usernames and emails are unique among traditional accounts only:
+    # generated Web3 usernames may repeat, as they always could
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS users_username
+        ON users (username) WHERE auth_type = 'traditional'
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS users_email
+        ON users (email) WHERE auth_type = 'traditional'
+    ''')
+
+    # Wallet addresses are stored lowercased, one account per address and chain
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS users_wallet
+        ON users (wallet_address, chain) WHERE wallet_address IS NOT NULL
+    ''')
+
+    # Store-wide JSON values such as the migration marker
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # Usage statistics are counters updated in place, so concurrent logins
+    # add to them instead of overwriting each other's copy
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_stats (
+            wallet_type TEXT NOT NULL,
+            chain TEXT NOT NULL,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            total_logins INTEGER NOT NULL DEFAULT 0,
+            last_used TEXT,
+            PRIMARY KEY (wallet_type, chain)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chain_stats (
+            chain TEXT PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0,
+            logins INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _seed_chain_stats(conn)
+
+    # Accounts per chain and wallet type, for analytics. Triggers keep it
+    # current in the same transaction as every account write, so nothing
+    # has to count the users table to show it.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_summary (
+            chain TEXT NOT NULL,
+            wallet_type TEXT NOT NULL,
+            users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chain, wallet_type)
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_summary_insert AFTER INSERT ON users BEGIN
+            INSERT INTO user_summary (chain, wallet_type, users) VALUES ({_summary_key('NEW')}, 1)
+            ON CONFLICT (chain, wallet_type) DO UPDATE SET users = users + 1;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_summary_delete AFTER DELETE ON users BEGIN
+            UPDATE user_summary SET users = users - 1 WHERE (chain, wallet_type) = ({_summary_key('OLD')});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_summary_update AFTER UPDATE ON users
+        WHEN ({_summary_key('OLD')}) <> ({_summary_key('NEW')}) BEGIN
+            UPDATE user_summary SET users = users - 1 WHERE (chain, wallet_type) = ({_summary_key('OLD')});
+            INSERT INTO user_summary (chain, wallet_type, users) VALUES ({_summary_key('NEW')}, 1)
+            ON CONFLICT (chain, wallet_type) DO UPDATE SET users = users + 1;
+        END
+    ''')
+
+def _summary_key(row):
+    """SQL for the (chain, wallet_type) summary key of a row of users
+
+    Traditional accounts are counted under ('', '').
+    """
+    return (
+        f"coalesce({row}.chain, ''), "
+        f"CASE WHEN {row}.wallet_address IS NULL THEN '' "
+        f"ELSE coalesce(json_extract({row}.data, '$.wallet_type'), 'unknown') END"
+    )
+
+def _seed_chain_stats(conn):
+    """Make sure every supported chain has a statistics row"""
+    for chain in empty_users_data()['chain_stats']:
+        conn.execute('INSERT OR IGNORE INTO chain_stats (chain) VALUES (?)', (chain,))
+
+@contextlib.contextmanager
+def transaction():
+    """Run a block as one write transaction, committed at the end
+
+    The write lock is taken up front (BEGIN IMMEDIATE), so reads inside the
+    block cannot be invalidated by another writer before the block commits.
+    Nested blocks join the outer transaction.
+    """
+    conn = get_db_connection()
+    if thread_local.depth:
+        thread_local.depth += 1
+        try:
+            yield conn
+        finally:
+            thread_local.depth -= 1
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    thread_local.depth = 1
+    try:
+        yield conn
+        conn.execute('COMMIT')
+        _count('writes')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        thread_local.depth = 0
+
+def _row_to_user(row):
+    """Rebuild the user dict the JSON file used to hold"""
+    if row is None:
+        return None
+    user = {'id': row['id'], 'username': row['username']}
+    if row['email'] is not None:
+        user['email'] = row['email']
+    if row['wallet_address'] is not None:
+        user['wallet_address'] = row['wallet_address']
+        user['chain'] = row['chain']
+    user.update(json.loads(row['data']))
+    user['auth_type'] = row['auth_type']
+    return user
+
+def _user_values(user):
+    """Column values for a user dict, with everything else as JSON"""
+    auth_type = user.get('auth_type') or ('web3' if user.get('wallet_address') else 'traditional')
+    wallet_address = user.get('wallet_address')
+    return (
+        user.get('id'),
+        auth_type,
+        user['username'],
+        user.get('email'),
+        wallet_address.lower() if wallet_address else None,
+        # Records from before multi-chain support are Ethereum wallets
+        user.get('chain', 'ethereum') if wallet_address else None,
+        json.dumps({key: value for key, value in user.items() if key not in _COLUMNS})
+    )
+
+def find_by_username(username):
+    """Traditional account with this username"""
+    _count('reads')
+    row = get_db_connection().execute(
+        "SELECT * FROM users WHERE username = ? AND auth_type = 'traditional'", (username,)
+    ).fetchone()
+    return _row_to_user(row)
+
+def find_by_email(email):
+    """Traditional account with this email"""
+    _count('reads')
+    row = get_db_connection().execute(
+        "SELECT * FROM users WHERE email = ? AND auth_type = 'traditional'", (email,)
+    ).fetchone()
+    return _row_to_user(row)
+
+def find_by_wallet(wallet_address, chain=None):
+    """Account of a wallet, on one chain or on the first chain it was registered on"""
+    _count('reads')
+    if chain:
+        row = get_db_connection().execute(
+            "SELECT * FROM users WHERE wallet_address = ? AND chain = ?", (wallet_address.lower(), chain)
+        ).fetchone()
+    else:
+        row = get_db_connection().execute(
+            "SELECT * FROM users WHERE wallet_address = ? ORDER BY id LIMIT 1", (wallet_address.lower(),)
+        ).fetchone()
+    return _row_to_user(row)
+
+def find_by_id(user_id):
+    """Account with this ID"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    _count('reads')
+    row = get_db_connection().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    return _row_to_user(row)
+
+def insert_user(user):
+    """Add an account and return it with its new ID
+
+    Raises sqlite3.IntegrityError if the username, email or wallet is taken.
+    """
+    user = dict(user)
+    user.pop('id', None)
+    with transaction() as conn:
+        cursor = conn.execute(
+            'INSERT INTO users (id, auth_type, username, email, wallet_address, chain, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            _user_values(user)
+        )
+    user['id'] = cursor.lastrowid
+    return user
+
+def update_user(user):
+    """Write a changed account back, matched on its ID"""
+    values = _user_values(user)
+    with transaction() as conn:
+        conn.execute(
+            'UPDATE users SET auth_type = ?, username = ?, email = ?, wallet_address = ?, chain = ?, data = ? WHERE id = ?',
+            values[1:] + values[:1]
+        )
+
+def list_web3_user_ids():
+    """IDs of all Web3 accounts"""
+    _count('reads')
+    rows = get_db_connection().execute('SELECT id FROM users WHERE wallet_address IS NOT NULL ORDER BY id')
+    return [row['id'] for row in rows]
+
+def get_metadata(key, default=None):
+    """Read a store-wide JSON value"""
+    _count('reads')
+    row = get_db_connection().execute('SELECT value FROM user_metadata WHERE key = ?', (key,)).fetchone()
+    return json.loads(row['value']) if row else default
+
+def set_metadata(key, value):
+    """Write a store-wide JSON value"""
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO user_metadata (key, value) VALUES (?, ?)', (key, json.dumps(value))
+        )
+
+def record_wallet_use(wallet_type, chain, logins=1, users=0, last_used=None):
+    """Add logins and new users to the statistics of a wallet and chain
+
+    Only memory is touched: the counts are written by flush_wallet_stats()
+    within STATS_FLUSH_INTERVAL seconds, or when the process exits.
+    """
+    global _flush_timer
+    with _pending_lock:
+        pending = _pending_wallets.setdefault((wallet_type, chain), [0, 0, None])
+        pending[0] += users
+        pending[1] += logins
+        if last_used and (pending[2] is None or last_used > pending[2]):
+            pending[2] = last_used
+
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(STATS_FLUSH_INTERVAL, flush_wallet_stats)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+def flush_wallet_stats():
+    """Write the buffered statistics in one transaction
+
+    The counters are incremented in SQL, so workers flushing at the same
+    time add up. Counts that fail to write are kept for the next flush.
+    Returns the number of logins written.
+    """
+    global _flush_timer
+    with _pending_lock:
+        pending = dict(_pending_wallets)
+        _pending_wallets.clear()
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+    if not pending:
+        return 0
+
+    chains = {}
+    for (wallet_type, chain), (users, logins, last_used) in pending.items():
+        chain_users, chain_logins = chains.get(chain, (0, 0))
+        chains[chain] = (chain_users + users, chain_logins + logins)
+
+    try:
+        with transaction() as conn:
+            conn.executemany('''
+                INSERT INTO wallet_stats (wallet_type, chain, total_users, total_logins, last_used)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (wallet_type, chain) DO UPDATE SET
+                    total_users = total_users + excluded.total_users,
+                    total_logins = total_logins + excluded.total_logins,
+                    last_used = coalesce(max(last_used, excluded.last_used), last_used, excluded.last_used)
+            ''', [key + tuple(counts) for key, counts in pending.items()])
+            # Only supported chains are counted in the chain statistics
+            conn.executemany(
+                'UPDATE chain_stats SET users = users + ?, logins = logins + ? WHERE chain = ?',
+                [(users, logins, chain) for chain, (users, logins) in chains.items()]
+            )
+    except sqlite3.Error as e:
+        print(f"Could not write wallet statistics, retrying later: {e}")
+        for key, (users, logins, last_used) in pending.items():
+            record_wallet_use(*key, logins=logins, users=users, last_used=last_used)
+        return 0
+    return sum(logins for _, logins, _ in pending.values())
+
+def _pending_stats():
+    """Copy of the statistics not yet written by this process"""
+    with _pending_lock:
+        return {key: list(counts) for key, counts in _pending_wallets.items()}
+
+def _forget_pending_stats():
+    """Drop the parent's buffer in a forked worker, so it is written only once"""
+    global _pending_lock, _flush_timer
+    _pending_lock = threading.Lock()
+    _pending_wallets.clear()
+    _flush_timer = None
+
+atexit.register(flush_wallet_stats)
+os.register_at_fork(after_in_child=_forget_pending_stats)
+
+def get_wallet_stats():
+    """Wallet statistics keyed "<wallet_type>_<chain>", as user.json had them
+
+    Includes this process's counts that are not written yet.
+    """
+    _count('reads')
+    rows = get_db_connection().execute('SELECT * FROM wallet_stats ORDER BY wallet_type, chain')
+    wallet_stats = {f"{row['wallet_type']}_{row['chain']}": dict(row) for row in rows}
+    for (wallet_type, chain), (users, logins, last_used) in _pending_stats().items():
+        stats = wallet_stats.setdefault(f"{wallet_type}_{chain}", {
+            'wallet_type': wallet_type, 'chain': chain, 'total_users': 0, 'total_logins': 0, 'last_used': None
+        })
+        stats['total_users'] += users
+        stats['total_logins'] += logins
+        stats['last_used'] = max(filter(None, (stats['last_used'], last_used)), default=None)
+    return wallet_stats
+
+def get_chain_stats():
+    """Users and logins per supported chain
+
+    Includes this process's counts that are not written yet.
+    """
+    _count('reads')
+    rows = get_db_connection().execute('SELECT * FROM chain_stats ORDER BY rowid')
+    chain_stats = {row['chain']: {'users': row['users'], 'logins': row['logins']} for row in rows}
+    for (_, chain), (users, logins, _) in _pending_stats().items():
+        if chain in chain_stats:
+            chain_stats[chain]['users'] += users
+            chain_stats[chain]['logins'] += logins
+    return chain_stats
+
+def _insert_stats(conn, users_data):
+    """Replace the statistics with those of a user.json document"""
+    if 'wallet_stats' in users_data:
+        conn.execute('DELETE FROM wallet_stats')
+        for stats in users_data['wallet_stats'].values():
+            conn.execute(
+                'INSERT OR REPLACE INTO wallet_stats (wallet_type, chain, total_users, total_logins, last_used) VALUES (?, ?, ?, ?, ?)',
+                (stats.get('wallet_type', 'unknown'), stats.get('chain', 'ethereum'),
+                 stats.get('total_users', 0), stats.get('total_logins', 0), stats.get('last_used'))
+            )
+
+    if 'chain_stats' in users_data:
+        conn.execute('DELETE FROM chain_stats')
+        for chain, stats in users_data['chain_stats'].items():
+            conn.execute(
+                'INSERT INTO chain_stats (chain, users, logins) VALUES (?, ?, ?)',
+                (chain, stats.get('users', 0), stats.get('logins', 0))
+            )
+        _seed_chain_stats(conn)
+
+def _migrate_stats_metadata():
+    """Move statistics kept as JSON metadata by earlier versions into their tables"""
+    query = "SELECT key, value FROM user_metadata WHERE key IN ('wallet_stats', 'chain_stats')"
+    if get_db_connection().execute(query).fetchone() is None:
+        return
+
+    with transaction() as conn:
+        # Another worker may have moved them while this one waited for the lock
+        rows = conn.execute(query).fetchall()
+        if not rows:
+            return
+        _insert_stats(conn, {row['key']: json.loads(row['value']) for row in rows})
+        conn.execute("DELETE FROM user_metadata WHERE key IN ('wallet_stats', 'chain_stats')")
+
+def get_user_summary():
+    """Accounts per (chain, wallet_type), with traditional accounts under ('', '')"""
+    _count('reads')
+    rows = get_db_connection().execute('SELECT chain, wallet_type, users FROM user_summary WHERE users > 0')
+    return {(row['chain'], row['wallet_type']): row['users'] for row in rows}
+
+def count_user_summary():
+    """The account summary recounted from the users table; reads every account"""
+    _count('reads')
+    rows = get_db_connection().execute(f'''
+        SELECT {_summary_key('users')}, count(*) FROM users GROUP BY 1, 2
+    ''')
+    return {(row[0], row[1]): row[2] for row in rows}
+
+def rebuild_user_summary():
+    """Replace the account summary with a recount"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM user_summary')
+        conn.execute(f'''
+            INSERT INTO user_summary (chain, wallet_type, users)
+            SELECT {_summary_key('users')}, count(*) FROM users GROUP BY 1, 2
+        ''')
+        conn.execute(
+            'INSERT OR REPLACE INTO user_metadata (key, value) VALUES (?, ?)',
+            ('user_summary_built_at', json.dumps(time.time()))
+        )
+
+def verify_user_summary(repair=False):
+    """Compare the account summary with a full recount
+
+    Returns {(chain, wallet_type): (stored, counted)} for every difference;
+    with repair, the summary is rebuilt when there are any.
+    """
+    with transaction():
+        stored = get_user_summary()
+        counted = count_user_summary()
+        differences = {
+            key: (stored.get(key, 0), counted.get(key, 0))
+            for key in stored.keys() | counted.keys()
+            if stored.get(key, 0) != counted.get(key, 0)
+        }
+        if differences and repair:
+            rebuild_user_summary()
+    return differences
+
+def _build_user_summary():
+    """Count the accounts of a store created before the summary existed, once"""
+    query = "SELECT 1 FROM user_metadata WHERE key = 'user_summary_built_at'"
+    if get_db_connection().execute(query).fetchone() is not None:
+        return
+
+    with transaction() as conn:
+        # Another worker may have built it while this one waited for the lock
+        if conn.execute(query).fetchone() is None:
+            rebuild_user_summary()
+
+def load_users_data():
+    """The whole store in the shape user.json had
+
+    Reads every account; request paths should use the find_* lookups.
+    """
+    users_data = empty_users_data()
+    _count('reads')
+    for row in get_db_connection().execute('SELECT * FROM users ORDER BY id'):
+        user = _row_to_user(row)
+        users_data['web3_users' if row['wallet_address'] is not None else 'users'].append(user)
+    users_data['wallet_stats'] = get_wallet_stats()
+    users_data['chain_stats'] = get_chain_stats()
+    return users_data
+
+def _insert_users_data(conn, users_data):
+    """Insert every account and the statistics of a user.json document
+
+    Accounts clashing with one inserted before them are skipped, matching
+    the old lookups, which returned the first match. Returns the number of
+    accounts skipped.
+    """
+    skipped = 0
+    for user in users_data.get('users', []) + users_data.get('web3_users', []):
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO users (id, auth_type, username, email, wallet_address, chain, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            _user_values(user)
+        )
+        skipped += cursor.rowcount == 0
+
+    _insert_stats(conn, users_data)
+    return skipped
+
+def replace_users_data(users_data):
+    """Replace the whole store with a user.json-shaped document
+
+    Statistics in the document replace the buffered ones too: a document
+    from load_users_data() already counts them.
+    """
+    with transaction() as conn:
+        conn.execute('DELETE FROM users')
+        _insert_users_data(conn, users_data)
+    if 'wallet_stats' in users_data or 'chain_stats' in users_data:
+        with _pending_lock:
+            _pending_wallets.clear()
+
+def migrate_from_json(path):
+    """Import a user.json file into an empty store, once
+
+    The import runs inside one write transaction, so when several workers
+    start at the same time exactly one of them imports. The file is left
+    in place as a backup.
+    """
+    if not os.path.exists(path):
+        return False
+
+    query = "SELECT 1 FROM user_metadata WHERE key = 'json_migrated_at'"
+    if get_db_connection().execute(query).fetchone() is not None:
+        return False
+
+    with transaction() as conn:
+        # Another worker may have imported it while this one waited for the lock
+        if conn.execute(query).fetchone() is not None:
+            return False
+
+        try:
+            with open(path, 'r') as f:
+                users_data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not read {path} for migration: {e}")
+            return False
+
+        skipped = _insert_users_data(conn, users_data)
+        conn.execute(
+            'INSERT OR REPLACE INTO user_metadata (key, value) VALUES (?, ?)',
+            ('json_migrated_at', json.dumps(time.time()))
+        )
+
+    message = f"Migrated users from {path} to {USER_DB_PATH}"
+    if skipped:
+        message += f" ({skipped} duplicate accounts skipped)"
+    print(message)
+    return True
+
+if __name__ == "__main__":
+    import sys
+
+    # `python -m logic.user_store verify` recounts the account summary behind
+    # the analytics and reports differences; `verify --repair` also fixes them
+    command = sys.argv[1:]
+    if command not in (['verify'], ['verify', '--repair']):
+        print("Usage: python -m logic.user_store verify [--repair]")
+        sys.exit(2)
+
+    differences = verify_user_summary(repair='--repair' in command)
+    for (chain, wallet_type), (stored, counted) in sorted(differences.items()):
+        print(f"{chain or 'traditional'} {wallet_type or '-'}: summary {stored}, counted {counted}")
+    if not differences:
+        print("Account summary matches the users table.")
+    elif '--repair' in command:
+        print("Account summary rebuilt.")
+    sys.exit(1 if differences and '--repair' not in command else 0)